@@ -1,75 +1,14 @@
 import os
 import sys
-import fitz
-import string
 import re
-import numpy as np
-import pandas as pd
-from PyQt5 import QtWidgets, QtCore
-from PyQt5.QtWidgets import QApplication, QMainWindow, QFileDialog, QMessageBox, QLabel, QLineEdit, QPushButton, QProgressBar, QVBoxLayout, QHBoxLayout, QWidget
+from PyQt5.QtWidgets import QApplication, QMainWindow, QFileDialog, QMessageBox, QLabel, QLineEdit, QPushButton, QProgressBar, QSpinBox, QComboBox, QListWidget, QVBoxLayout, QHBoxLayout, QWidget
 from PyQt5.QtGui import QPainter, QBrush, QLinearGradient, QColor, QPalette, QRadialGradient, QPainterPath, QFontMetrics
-from PyQt5.QtCore import Qt, QEvent, QPoint, QRectF
+from PyQt5.QtCore import Qt, QEvent, QPoint, QRectF, QThread, pyqtSignal
 import time
-import threading
-import csv
-import shutil
-import PyPDF2
-
-YELLOW = np.array([1.0, 1.0, 0.0])
-BLUE = np.array([0.0, 0.0, 1.0])
-
-def closest_color(color):
-    color = np.array(color)
-    distances = {np.linalg.norm(color - YELLOW): "Yellow", np.linalg.norm(color - BLUE): "Blue"}
-    return distances[min(distances)]
-
-def count_files_in_make(make_path):
-    count = 0
-    years = [os.path.join(make_path, year) for year in os.listdir(make_path) if os.path.isdir(os.path.join(make_path, year))]
-    for year in years:
-        models = [os.path.join(year, model) for model in os.listdir(year) if os.path.isdir(os.path.join(year, model))]
-        for model in models:
-            for root, dirs, files in os.walk(model):
-                for file in files:
-                    if file.endswith(".pdf"):
-                        count += 1
-    return count
-
-def extract_info_from_path(file_path):
-    _, make_year_model_system, _ = file_path.split(os.sep)[-3:]
-    matches = re.findall(r'\b\d+\b|\b[A-Z][a-z]*\b', make_year_model_system)
-    year = matches[0] if matches else "N/A"
-    make = matches[1] if len(matches) > 1 else "N/A"
-    model = matches[2] if len(matches) > 2 else "N/A"
-    system = matches[3] if len(matches) > 3 else "N/A"
-    return year, make, model, system
-
-def extract_highlights(file_path):
-    try:
-        doc = fitz.open(file_path)
-    except:
-        print(f"Could not open {file_path}, skipping...")
-        return [{"Year": file_path.split(os.sep)[-3], "Make": file_path.split(os.sep)[-4], "Model": file_path.split(os.sep)[-2], "System": "N/A", "Text": "Could not open file.", "Color": "N/A"}]
-    num_pages = len(doc)
-    match = re.search(r'\((.*?)\)', os.path.basename(file_path))
-    if match is None:
-        print(f"No system found in file name of {file_path}, skipping...")
-        return [{"Year": file_path.split(os.sep)[-3], "Make": file_path.split(os.sep)[-4], "Model": file_path.split(os.sep)[-2], "System": "N/A", "Text": "No system found in file name.", "Color": "N/A"}]
-    system = match.group(1)
-    highlights = []
-    for page_num in range(num_pages):
-        page = doc[page_num]
-        annotations = page.annots()
-        for annotation in annotations:
-            if annotation.type[1] == "Highlight":
-                highlight_color = closest_color(annotation.colors["stroke"])
-                highlight_rect = fitz.Rect(annotation.rect)
-                words = page.get_text("words", clip=highlight_rect)  # get text in the highlighted area
-                highlighted_text = ' '.join([word[4] for word in words])
-                printable = set(string.printable)
-                highlighted_text = ''.join(filter(lambda x: x in printable, highlighted_text))  # remove any non-printable characters
-                highlights.append({"Year": file_path.split(os.sep)[-3], "Make": file_path.split(os.sep)[-4], "Model": file_path.split(os.sep)[-2], "System": system, "Text": highlighted_text, "Color": highlight_color})
-    return highlights
+import multiprocessing
+from si_core import COPY_MODES, SPLIT_PART_KB, COMPRESSION_PRESETS, DEFAULT_PRESET, default_workers, compress_library, extract_library, copy_library
+from si_search import search_highlights
+from si_watch import watch_library
 
 class RoundedButton(QPushButton):
     def __init__(self, text, parent=None):
@@ -136,11 +75,61 @@ def paintEvent(self, event):
         line_y = text_y + (index * (text_height + 5))  # Adjusted for spacing
         painter.drawText(text_x, line_y, task)
 
+def format_eta(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+class JobRunner(QThread):
+    # Runs job(runner) off the GUI thread; the job calls runner.report() per file and polls runner.is_cancelled()
+    progress = pyqtSignal(float)  # share of the work done, 0-1
+    eta = pyqtSignal(float)  # seconds remaining
+    current_file = pyqtSignal(str)
+    error = pyqtSignal(str, str)  # file path, message
+    finished_job = pyqtSignal(object)  # whatever job returned
+
+    def __init__(self, job, parent=None):
+        super().__init__(parent)
+        self.job = job
+        self.cancelled = False
+        self.failure = None  # Message of the exception the job itself raised, if it did
+        self.start_time = None
+
+    def cancel(self):
+        self.cancelled = True
+
+    def is_cancelled(self):
+        return self.cancelled
+
+    def report(self, done, total, file_path="", fraction=None):
+        # fraction is the share of the estimated cost done, so big files move the bar and the ETA more than
+        # small ones; without it the share of files done is used
+        if fraction is None:
+            fraction = done / total if total else 1.0
+        self.progress.emit(fraction)
+        if file_path:
+            self.current_file.emit(file_path)
+        elapsed_time = time.time() - self.start_time
+        if fraction > 0:
+            self.eta.emit(elapsed_time / fraction * (1 - fraction))
+
+    def run(self):
+        self.start_time = time.time()
+        result = None
+        try:
+            result = self.job(self)
+        except Exception as e:
+            self.failure = str(e)
+            self.error.emit("", str(e))
+        self.finished_job.emit(result)
+
 class BabyHipsGUI(QMainWindow):
     def __init__(self):
         super().__init__()
         self.title = "S.I. Multi-Tool"
         self.dark_mode = False  # Track the theme status
+        self.highlight_index = {}  # file_path -> (size, mtime, {page_num: colors}) from the last highlight scan
+        self.job_runner = None
+        self.job_errors = 0
         self.initUI()
 
     def initUI(self):
@@ -172,9 +161,48 @@ class BabyHipsGUI(QMainWindow):
         output_layout.addWidget(self.create_in_button)
         layout.addLayout(output_layout)
 
+        self.workers_label = QLabel("Workers:", self)
+        self.workers_spin = QSpinBox(self)
+        self.workers_spin.setRange(1, os.cpu_count() or 1)
+        self.workers_spin.setValue(default_workers())
+
+        self.preset_label = QLabel("Compression:", self)
+        self.preset_combo = QComboBox(self)
+        self.preset_combo.addItems(list(COMPRESSION_PRESETS))
+        self.preset_combo.setCurrentText(DEFAULT_PRESET)
+
+        self.memory_label = QLabel("Memory per worker:", self)
+        self.memory_spin = QSpinBox(self)
+        self.memory_spin.setRange(0, 64 * 1024)
+        self.memory_spin.setSingleStep(256)
+        self.memory_spin.setSuffix(" MB")
+        self.memory_spin.setSpecialValueText("No limit")  # Shown for 0
+
+        workers_layout = QHBoxLayout()
+        workers_layout.addWidget(self.workers_label)
+        workers_layout.addWidget(self.workers_spin)
+        workers_layout.addWidget(self.preset_label)
+        workers_layout.addWidget(self.preset_combo)
+        workers_layout.addWidget(self.memory_label)
+        workers_layout.addWidget(self.memory_spin)
+        layout.addLayout(workers_layout)
+
         self.compress_button = RoundedButton("Compress Files", self)
         self.compress_button.clicked.connect(self.compress_pdfs)
-        layout.addWidget(self.compress_button)
+        self.extract_button = RoundedButton("Extract Highlights", self)
+        self.extract_button.clicked.connect(self.extract_highlights_action)
+        self.watch_button = RoundedButton("Watch Folder", self)
+        self.watch_button.clicked.connect(self.watch_folder_action)
+        self.cancel_button = RoundedButton("Cancel", self)
+        self.cancel_button.clicked.connect(self.cancel_job)
+        self.cancel_button.setEnabled(False)
+
+        action_layout = QHBoxLayout()
+        action_layout.addWidget(self.compress_button)
+        action_layout.addWidget(self.extract_button)
+        action_layout.addWidget(self.watch_button)
+        action_layout.addWidget(self.cancel_button)
+        layout.addLayout(action_layout)
 
         self.progress_label = QLabel("Progress:", self)
         self.progress_bar = QProgressBar(self)
@@ -187,17 +215,38 @@ class BabyHipsGUI(QMainWindow):
         progress_layout.addWidget(self.percentage_label)
         layout.addLayout(progress_layout)
 
+        self.status_label = QLabel("", self)
+        layout.addWidget(self.status_label)
+
+        # Search over the index Extract Highlights leaves next to its CSV
+        self.search_entry = QLineEdit(self)
+        self.search_entry.setPlaceholderText("Search extracted highlights (e.g. calibration 2019)")
+        self.search_entry.returnPressed.connect(self.search_highlights_action)
+        self.search_button = RoundedButton("Search", self)
+        self.search_button.clicked.connect(self.search_highlights_action)
+        self.search_results = QListWidget(self)
+        self.search_results.setVisible(False)
+
+        search_layout = QHBoxLayout()
+        search_layout.addWidget(self.search_entry)
+        search_layout.addWidget(self.search_button)
+        layout.addLayout(search_layout)
+        layout.addWidget(self.search_results)
+
         self.copy_yellow_button = RoundedButton("Copy Yellow Highlights", self)
         self.copy_yellow_button.clicked.connect(self.copy_yellow_pages)
         self.copy_blue_button = RoundedButton("Copy Blue Highlights", self)
         self.copy_blue_button.clicked.connect(self.copy_blue_pages)
         self.copy_yb_button = RoundedButton("Copy Y/B Highlights", self)
         self.copy_yb_button.clicked.connect(self.copy_yb_pages)
+        self.copy_all_button = RoundedButton("Copy All Highlights", self)
+        self.copy_all_button.clicked.connect(self.copy_all_pages)
 
         copy_layout = QHBoxLayout()
         copy_layout.addWidget(self.copy_yellow_button)
         copy_layout.addWidget(self.copy_blue_button)
         copy_layout.addWidget(self.copy_yb_button)
+        copy_layout.addWidget(self.copy_all_button)
         layout.addLayout(copy_layout)
 
         # Dark Mode Toggle Button
@@ -269,155 +318,96 @@ class BabyHipsGUI(QMainWindow):
         """
         self.setStyleSheet(dark_stylesheet)
 
-    def move_and_split_files(self):
-        try:
-            oversized_files = []  # List to store information about oversized PDF files
-            for root, dirs, files in os.walk(self.parent_directory_path):
-                for file_name in files:
-                    file_path = os.path.join(root, file_name)
-                    try:
-                        if file_name.lower().endswith(".pdf"):
-                            if any(file_name.lower().endswith(f"part-{i}.pdf") for i in range(1, 5)):
-                                self.compress_pdf(file_path)
-                            else:
-                                self.compress_pdf(file_path)
-                                file_size_kb = os.path.getsize(file_path) / 1024
-                                if file_size_kb > 1400:
-                                    year = file_path.split(os.sep)[-3]
-                                    make = file_path.split(os.sep)[-4]
-                                    model = file_path.split(os.sep)[-2]
-                                    system = "N/A"  # You may want to extract the system information as well
-                                    file_size = f"{file_size_kb:.2f} KB"
-                                    oversized_files.append({"Year": year, "Make": make, "Model": model, "System": system, "File size": file_size})
-                                    new_folder_path = os.path.join(os.path.dirname(file_path), os.path.splitext(file_name)[0])
-                                    new_file_path = os.path.join(new_folder_path, file_name)
-                                    if os.path.exists(new_folder_path):
-                                        os.remove(new_file_path)
-                    except Exception as e:
-                        print(f"Error while processing {file_path}: {str(e)}")
-            csv_report_path = os.path.join(self.output_path_entry.get(), "oversized_files_report.csv")
-            if not oversized_files:
-                with open(csv_report_path, 'w', newline='', encoding='utf-8') as csv_file:
-                    csv_file.write("NO OVERSIZED PDF FILES")
-                print("No oversized PDF files found.")
-            else:
-                with open(csv_report_path, 'w', newline='', encoding='utf-8') as csv_file:
-                    fieldnames = ["Year", "Make", "Model", "System", "File size"]
-                    writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
-                    writer.writeheader()
-                    writer.writerows(oversized_files)
-                print("File moving, splitting, and compressing complete.")
-                print(f"Oversized PDF files report written to: {csv_report_path}")
-        except Exception as e:
-            print(f"Error while moving and splitting PDF files: {str(e)}")
+    def job_buttons(self):
+        return [self.compress_button, self.extract_button, self.watch_button, self.copy_yellow_button, self.copy_blue_button, self.copy_yb_button, self.copy_all_button, self.pull_from_button, self.create_in_button, self.workers_spin, self.preset_combo, self.memory_spin]
+
+    def memory_limit(self):
+        return self.memory_spin.value() or None
+
+    def start_job(self, job, on_finished):
+        # Returns False (after telling the user) when another job is still running
+        if self.job_runner is not None and self.job_runner.isRunning():
+            QMessageBox.warning(self, "Busy", "Another operation is still running.")
+            return False
+        self.job_errors = 0
+        self.progress_bar.setValue(0)
+        self.percentage_label.setText("0%")
+        self.status_label.setText("Starting...")
+        for widget in self.job_buttons():
+            widget.setEnabled(False)
+        self.cancel_button.setEnabled(True)
+        self.job_runner = JobRunner(job, self)
+        self.job_runner.progress.connect(self.update_progress)
+        self.job_runner.eta.connect(self.update_eta)
+        self.job_runner.current_file.connect(lambda file_path: self.status_label.setText(os.path.basename(file_path)))
+        self.job_runner.error.connect(self.report_job_error)
+        self.job_runner.finished_job.connect(lambda result: self.finish_job(result, on_finished))
+        self.job_runner.start()
+        return True
+
+    def update_progress(self, fraction):
+        total_percentage = int(fraction * 100)
+        self.progress_bar.setValue(total_percentage)
+        self.percentage_label.setText(f"{total_percentage}%")
+
+    def update_eta(self, remaining_time):
+        self.percentage_label.setText(f"{self.progress_bar.value()}% (ETA {format_eta(remaining_time)})")
+
+    def report_job_error(self, file_path, message):
+        self.job_errors += 1
+        print(f"Error while processing {file_path}: {message}")
+
+    def finish_job(self, result, on_finished):
+        cancelled = self.job_runner.is_cancelled()
+        failure = self.job_runner.failure
+        for widget in self.job_buttons():
+            widget.setEnabled(True)
+        self.cancel_button.setEnabled(False)
+        self.percentage_label.setText(f"{self.progress_bar.value()}%")
+        status = "Failed" if failure else "Cancelled" if cancelled else "Done"
+        if self.job_errors and not failure:
+            status += f" ({self.job_errors} file(s) failed, see console)"
+        self.status_label.setText(status)
+        if failure:
+            # The run itself stopped (unwritable output folder, report or cache); no success message for it
+            QMessageBox.critical(self, "Error", f"The operation stopped with an error:\n{failure}")
+        elif not cancelled:
+            on_finished(result)
+
+    def cancel_job(self):
+        if self.job_runner is not None and self.job_runner.isRunning():
+            self.job_runner.cancel()
+            self.status_label.setText("Cancelling after the current file(s)...")
+
+    def closeEvent(self, event):
+        if self.job_runner is not None and self.job_runner.isRunning():
+            self.job_runner.cancel()
+            self.job_runner.wait()
+        super().closeEvent(event)
 
-    def compress_pdf(self, input_path):
-        try:
-            file_size_kb = os.path.getsize(input_path) / 1024  # Calculate file size in kilobytes
-            if file_size_kb > 1400:
-                folder_name = os.path.splitext(os.path.basename(input_path))[0]
-                folder_path = os.path.join(os.path.dirname(input_path), folder_name)
-                os.makedirs(folder_path, exist_ok=True)
-                new_file_path = os.path.join(folder_path, os.path.basename(input_path))
-                shutil.move(input_path, new_file_path)
-                with open(new_file_path, 'rb') as pdf_file:
-                    pdf = PyPDF2.PdfReader(pdf_file)
-                    num_pages = len(pdf.pages)
-                    current_part_num = 1
-                    current_part = PyPDF2.PdfWriter()
-                    pages_per_split = 5
-                    for page_num in range(num_pages):
-                        current_part.add_page(pdf.pages[page_num])
-                        if len(current_part.pages) >= pages_per_split:
-                            output_file = os.path.join(folder_path, f"{folder_name} part-{current_part_num}.pdf")
-                            with open(output_file, "wb") as f:
-                                current_part.write(f)
-                            current_part_num += 1
-                            current_part = PyPDF2.PdfWriter()
-                    if len(current_part.pages) > 0:
-                        output_file = os.path.join(folder_path, f"{folder_name}_part-{current_part_num}.pdf")
-                        with open(output_file, "wb") as f:
-                            current_part.write(f)
-                os.remove(new_file_path)
-
-            else:
-                output_path = input_path  # Use the same input path as the output path
-                doc = fitz.open(input_path)  # Open the document for compression
-                output_path = input_path  # Use the same input path as the output path
-                new_doc = fitz.open()  # Open a new document for compressed content
-                for page_num in range(len(doc)):
-                    try:
-                        new_doc.insert_pdf(doc, from_page=page_num, to_page=page_num, rotate=0)
-                    except Exception as e:
-                        print(f"Error while compressing page {page_num + 1} of {input_path}: {str(e)}")
-                doc.close()  # Close the original document
-                new_doc.save(output_path, garbage=4, deflate=True, clean=True)
-                new_doc.close()  # Close the new document
-        except Exception as e:
-            print(f"Error while compressing PDF: {str(e)}")
-            
     def compress_pdfs(self):
         parent_directory_path = self.input_path_entry.text()
         if not parent_directory_path:
             QMessageBox.critical(self, "Error", "Please select an input directory.")
             return
-        compressed_files = []
-        total_files = sum([len(files) for root, dirs, files in os.walk(parent_directory_path) if files])
-        processed_files = 0
-        self.start_time = time.time()  # Store the start time
-        for root, dirs, files in os.walk(parent_directory_path):
-            for file in files:
-                if file.endswith('.pdf'):
-                    input_path = os.path.join(root, file)
-                    for _ in range(3):
-                        try:
-                            self.compress_pdf(input_path)
-                            break  # Break the retry loop if successful
-                        except Exception as e:
-                            print(f"Error while compressing PDF: {str(e)}")
-                            time.sleep(1)
-                    processed_files += 1
-                    total_percentage = int((processed_files / total_files) * 100)  # Convert float to int
-                    elapsed_time = time.time() - self.start_time
-                    remaining_time = (elapsed_time / total_percentage) * (100 - total_percentage) if total_percentage != 0 else float('inf')  # Avoid division by zero
-                    print(f"Compressing: {file}. Total Progress: {total_percentage}%")
-                    self.progress_bar.setValue(total_percentage)  # Use integer value for setting progress
-                    self.percentage_label.setText(f"{total_percentage}%")
-                    QApplication.processEvents()  # Process events to update the GUI
-                    time.sleep(0.1)
-        self.move_and_split_files()
-        print(f'Compression and file moving/splitting complete.')
-
-    def split_pdf(self, input_file, output_folder):
-        try:
-            file_size_kb = os.path.getsize(input_file) / 1024  # Calculate file size in kilobytes
-            max_part_size_kb = 1300  # Adjust this value based on your requirement
-            if file_size_kb > max_part_size_kb:
-                input_pdf = fitz.open(input_file)
-                base_filename = os.path.splitext(os.path.basename(input_file))[0]
-                os.makedirs(output_folder, exist_ok=True)
-                part_num = 1
-                current_part_size = 0
-                current_part = fitz.open()
-                for page_num in range(input_pdf.page_count):
-                    if current_part_size > 0:
-                        output_file = os.path.join(output_folder, f"{base_filename} part-{part_num}.pdf")
-                        current_part.save(output_file)
-                        self.compress_pdf(output_file)  # Compress the last split file
-                        current_part.close()  # Close the current_part
-                    part_num += 1
-                    current_part_size = 0
-                    current_part = fitz.open()
-                input_pdf.close()
-                os.remove(input_file)
-        except Exception as e:
-            print(f"Error while splitting PDF: {str(e)}")
-    
+        output_dir = self.output_path_entry.text() or parent_directory_path
+        workers = self.workers_spin.value()
+        preset = self.preset_combo.currentText()
+        memory_limit_mb = self.memory_limit()
+        self.highlight_index = {}  # Compression rewrites the files, so earlier scans are stale
+        self.start_job(lambda runner: self.compress_job(runner, parent_directory_path, output_dir, workers, preset, memory_limit_mb),
+                       lambda result: QMessageBox.information(self, "Compress Files", "Compression and file moving/splitting complete."))
+
+    def compress_job(self, runner, parent_directory_path, output_dir, workers, preset=DEFAULT_PRESET, memory_limit_mb=None):
+        return compress_library(parent_directory_path, output_dir, workers=workers, progress=runner.report, cancelled=runner.is_cancelled, on_error=runner.error.emit,
+                                max_part_kb=SPLIT_PART_KB, preset=preset, memory_limit_mb=memory_limit_mb)
+
     def pull_from(self):
         directory_path = QFileDialog.getExistingDirectory(self, "Select Directory")
         if directory_path:  # Only update if a directory was selected
             self.input_path_entry.setText(directory_path)
             self.parent_directory_path = directory_path
+            self.highlight_index = {}
 
     def create_in(self):
         directory_path = QFileDialog.getExistingDirectory(self, "Select Directory")
@@ -425,219 +415,89 @@ class BabyHipsGUI(QMainWindow):
             self.output_path_entry.setText(directory_path)
             self.output_csv_path = os.path.join(directory_path, "Extracted Highlights.csv")
 
-    def closest_color(self, color):
-        color = np.array(color)
-        distances = {np.linalg.norm(color - YELLOW): "Yellow", np.linalg.norm(color - BLUE): "Blue"}
-        return distances[min(distances)]
-
-    def extract_info_from_path(self, file_path):
-        _, filename = os.path.split(file_path)
-        matches = re.findall(r'\b\d+\b|\b[A-Z][a-z]*\b', filename)
-        year = matches[0] if matches else "N/A"
-        make = matches[1] if len(matches) > 1 else "N/A"
-        model_match = re.search(r'\b[A-Z][a-zA-Z0-9 ]*\b', filename)
-        model = model_match.group() if model_match else "N/A"
-        model = model.replace(make, '').strip()
-        match = re.search(r'\((.*?)\)', filename)
-        system = match.group(1) if match else "N/A"
-        return year, make, model, system
-
-    def extract_highlights(self, file_path):
-        try:
-            doc = fitz.open(file_path)
-        except:
-            print(f"Could not open {file_path}, skipping...")
-            return [{"Year": "N/A", "Make": "N/A", "Model": "N/A", "System": "N/A", "Text": "Could not open file.", "HighlightColor": "N/A"}]
-        num_pages = len(doc)
-        _, filename = os.path.split(file_path)
-        match = re.search(r'\((.*?)\)', filename)
-        system = match.group(1) if match else "N/A"
-        year, make, model, _ = self.extract_info_from_path(file_path)
-        highlights = []
-        for page_num in range(num_pages):
-            page = doc[page_num]
-            annotations = page.annots()
-            for annotation in annotations:
-                if annotation.type[1] == "Highlight":
-                    color_classification = self.closest_color(annotation.colors["stroke"])
-                    highlight_rect = fitz.Rect(annotation.rect)
-                    words = page.get_text("words", clip=highlight_rect)
-                    highlighted_text = ' '.join([word[4] for word in words])
-                    printable = set(string.printable)
-                    highlighted_text = "".join(filter(lambda x: x in printable, highlighted_text))
-                    highlight = {
-                        "Year": year,
-                        "Make": make,
-                        "Model": model,
-                        "System": system,
-                        "Text": highlighted_text,
-                        "HighlightColor": color_classification
-                    }
-                    highlights.append(highlight)
-        return highlights
-
-    def count_files_in_make(self, make_path):
-        count = 0
-        years = [os.path.join(make_path, year) for year in os.listdir(make_path) if os.path.isdir(os.path.join(make_path, year))]
-        for year in years:
-            models = [os.path.join(year, model) for model in os.listdir(year) if os.path.isdir(os.path.join(year, model))]
-            for model in models:
-                for root, dirs, files in os.walk(model):
-                    for file in files:
-                        if file.endswith(".pdf"):
-                            count += 1
-        return count
-
     def extract_highlights_action(self):
         input_path = self.input_path_entry.text()
-        output_csv_path = self.output_csv_path
         if not input_path:
             QMessageBox.critical(self, "Error", "Please select an input directory.")
             return
-        makes = [os.path.join(input_path, make) for make in os.listdir(input_path) if os.path.isdir(os.path.join(input_path, make))]
-        total_files = sum([self.count_files_in_make(make) for make in makes])
-        processed_files = 0
-        self.process_directory(input_path, output_csv_path)
-
-    def process_directory(self, parent_directory_path, output_csv_path):
-        all_highlights = []
-        makes = [os.path.join(parent_directory_path, make) for make in os.listdir(parent_directory_path) if os.path.isdir(os.path.join(parent_directory_path, make))]
-        total_makes = len(makes)
-        total_files = sum([self.count_files_in_make(make) for make in makes])
-        processed_files = 0
-        for idx, make in enumerate(makes):
-            make_files = self.count_files_in_make(make)
-            if make_files == 0:
-                print(f"Skipping make {idx+1}/{total_makes} (No PDF files found)...")
-                continue
-            processed_make_files = 0
-            print(f"Processing make {idx+1}/{total_makes} ({make_files} files)...")
-            years = [os.path.join(make, year) for year in os.listdir(make) if os.path.isdir(os.path.join(make, year))]
-            for year in years:
-                models = [os.path.join(year, model) for model in os.listdir(year) if os.path.isdir(os.path.join(year, model))]
-                for model in models:
-                    for root, dirs, files in os.walk(model):
-                        for file in files:
-                            if file.endswith(".pdf"):
-                                file_path = os.path.join(root, file)
-                                highlights = self.extract_highlights(file_path)
-                                all_highlights.extend(highlights)
-                                processed_files += 1
-                                processed_make_files += 1
-            make_percentage = (processed_make_files / make_files) * 100
-            total_percentage = (processed_files / total_files) * 100
-            print(f"Finished Processing: {make}. Make Progress: {make_percentage:.2f}%")
-            print(f"Total Progress: {total_percentage:.2f}%")
-        num_highlights = len(all_highlights)
-        print(f"Total highlights found: {num_highlights}")
-        if num_highlights > 0:
-            with open(output_csv_path, "w", newline="", encoding="utf-8") as csv_file:  # add encoding="utf-8"
-                fieldnames = ["Year", "Make", "Model", "System", "Text", "HighlightColor"]
-                writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
-                writer.writeheader()
-                writer.writerows(all_highlights)
-            print(f"Highlights saved to {output_csv_path}")
-    def copy_pages(self, file_path, color):
+        output_csv_path = os.path.join(self.output_path_entry.text() or input_path, "Extracted Highlights.csv")
+        workers = self.workers_spin.value()
+        memory_limit_mb = self.memory_limit()
+        self.start_job(lambda runner: self.process_directory(input_path, output_csv_path, workers, runner, memory_limit_mb),
+                       lambda result: QMessageBox.information(self, "Extract Highlights", f"Highlights saved to {output_csv_path}"))
+
+    def search_highlights_action(self):
+        location = self.output_path_entry.text() or self.input_path_entry.text()
+        if not location:
+            QMessageBox.critical(self, "Error", "Please select the folder Extract Highlights wrote to.")
+            return
+        # Four-digit words filter on Year, other words match the highlight text
+        words = self.search_entry.text().split()
+        years = [word for word in words if re.fullmatch(r"\d{4}", word)]
+        query = " ".join(word for word in words if word not in years)
         try:
-            doc = fitz.open(file_path)
-        except:
-            print(f"Could not open {file_path}, skipping...")
+            matches = search_highlights(location, query, year=years[0] if years else None)
+        except FileNotFoundError as e:
+            QMessageBox.critical(self, "Search", str(e))
+            return
+        self.search_results.clear()
+        for match in matches:
+            self.search_results.addItem(f"{match['Year']} {match['Make']} {match['Model']} ({match['System']}) page {match['Page']} "
+                                        f"[{match['HighlightColor']}]: {match['Text']}")
+        self.search_results.setVisible(True)
+        self.status_label.setText(f"{len(matches)} matching highlights")
+
+    def watch_folder_action(self):
+        # Compresses new and changed PDFs and adds their highlights to the report until Cancel is pressed
+        input_path = self.input_path_entry.text()
+        if not input_path:
+            QMessageBox.critical(self, "Error", "Please select an input directory.")
+            return
+        output_dir = self.output_path_entry.text() or input_path
+        workers = self.workers_spin.value()
+        preset = self.preset_combo.currentText()
+        memory_limit_mb = self.memory_limit()
+        if self.start_job(lambda runner: watch_library(input_path, output_dir, workers=workers, progress=runner.report, cancelled=runner.is_cancelled, on_error=runner.error.emit,
+                                                       preset=preset, memory_limit_mb=memory_limit_mb),
+                          lambda result: None):
+            self.highlight_index = {}
+            self.status_label.setText(f"Watching {input_path} for new or changed PDFs (Cancel to stop)")
+
+    def process_directory(self, parent_directory_path, output_csv_path, workers=1, runner=None, memory_limit_mb=None):
+        if runner is None:
+            return extract_library(parent_directory_path, output_csv_path, workers, memory_limit_mb=memory_limit_mb)
+        return extract_library(parent_directory_path, output_csv_path, workers=workers, progress=runner.report, cancelled=runner.is_cancelled, on_error=runner.error.emit,
+                               memory_limit_mb=memory_limit_mb)
+
+    def copy_highlight_modes(self, modes, title, message):
+        input_path = self.input_path_entry.text()
+        output_path = self.output_path_entry.text()
+        if not input_path:
+            QMessageBox.critical(self, "Error", "Please select an input directory.")
             return
-        num_pages = len(doc)
-        for page_num in range(num_pages):
-            page = doc[page_num]
-            annotations = page.annots()
-            for annotation in annotations:
-                if annotation.type[1] == "Highlight":
-                    highlight_color = closest_color(annotation.colors["stroke"])
-                    if highlight_color == color:
-                        highlight_rect = fitz.Rect(annotation.rect)
-                        words = page.get_text("words", clip=highlight_rect)
-                        highlighted_text = ' '.join([word[4] for word in words])
-                        printable = set(string.printable)
-                        highlighted_text = ''.join(filter(lambda x: x in printable, highlighted_text))
-                        output_file_path = os.path.join(self.output_path_entry.text(), f"{os.path.splitext(os.path.basename(file_path))[0]}_{highlight_color}.pdf")
-                        new_doc = fitz.open()
-                        new_doc.insert_pdf(doc, from_page=page_num, to_page=page_num)
-                        new_doc.save(output_file_path)
-        doc.close()
+        workers = self.workers_spin.value()
+        memory_limit_mb = self.memory_limit()
+        self.start_job(lambda runner: self.copy_job(runner, input_path, output_path, modes, workers, memory_limit_mb),
+                       lambda result: QMessageBox.information(self, title, message))
+
+    def copy_job(self, runner, input_path, output_path, modes, workers, memory_limit_mb=None):
+        return copy_library(input_path, output_path, modes, workers=workers, highlight_index=self.highlight_index, progress=runner.report,
+                            cancelled=runner.is_cancelled, on_error=runner.error.emit, memory_limit_mb=memory_limit_mb)
 
     def copy_yellow_pages(self):
-        input_path = self.input_path_entry.text()
-        makes = [os.path.join(input_path, make) for make in os.listdir(input_path) if os.path.isdir(os.path.join(input_path, make))]
-        for make in makes:
-            years = [os.path.join(make, year) for year in os.listdir(make) if os.path.isdir(os.path.join(make, year))]
-            for year in years:
-                models = [os.path.join(year, model) for model in os.listdir(year) if os.path.isdir(os.path.join(year, model))]
-                for model in models:
-                    for root, dirs, files in os.walk(model):
-                        for file in files:
-                            if file.endswith(".pdf"):
-                                file_path = os.path.join(root, file)
-                                self.copy_pages(file_path, "Yellow")
-        QMessageBox.information(self, "Copy Yellow Highlights", "Yellow highlighted pages copied successfully!")
+        self.copy_highlight_modes(("Yellow",), "Copy Yellow Highlights", "Yellow highlighted pages copied successfully!")
 
     def copy_blue_pages(self):
-        input_path = self.input_path_entry.text()
-        makes = [os.path.join(input_path, make) for make in os.listdir(input_path) if os.path.isdir(os.path.join(input_path, make))]
-        for make in makes:
-            years = [os.path.join(make, year) for year in os.listdir(make) if os.path.isdir(os.path.join(make, year))]
-            for year in years:
-                models = [os.path.join(year, model) for model in os.listdir(year) if os.path.isdir(os.path.join(year, model))]
-                for model in models:
-                    for root, dirs, files in os.walk(model):
-                        for file in files:
-                            if file.endswith(".pdf"):
-                                file_path = os.path.join(root, file)
-                                self.copy_pages(file_path, "Blue")
-        QMessageBox.information(self, "Copy Blue Highlights", "Blue highlighted pages copied successfully!")
+        self.copy_highlight_modes(("Blue",), "Copy Blue Highlights", "Blue highlighted pages copied successfully!")
 
     def copy_yb_pages(self):
-        input_path = self.input_path_entry.text()
-        output_path = self.output_path_entry.text()
-        makes = [os.path.join(input_path, make) for make in os.listdir(input_path) if os.path.isdir(os.path.join(input_path, make))]
-        for make in makes:
-            years = [os.path.join(make, year) for year in os.listdir(make) if os.path.isdir(os.path.join(make, year))]
-            for year in years:
-                models = [os.path.join(year, model) for model in os.listdir(year) if os.path.isdir(os.path.join(year, model))]
-                for model in models:
-                    for root, dirs, files in os.walk(model):
-                        for file in files:
-                            if file.endswith(".pdf"):
-                                file_path = os.path.join(root, file)
-                                has_yellow = False
-                                has_blue = False
-                                doc = fitz.open(file_path)
-                                num_pages = len(doc)
-                                for page_num in range(num_pages):
-                                    page = doc[page_num]
-                                    annotations = page.annots()
-                                    for annotation in annotations:
-                                        if annotation.type[1] == "Highlight":
-                                            annotation_color = closest_color(annotation.colors["stroke"])
-                                            if annotation_color == "Yellow":
-                                                has_yellow = True
-                                            elif annotation_color == "Blue":
-                                                has_blue = True
-                                            if has_yellow and has_blue:
-                                                output_file_path = os.path.join(output_path, f"{os.path.splitext(os.path.basename(file_path))[0]}_YB.pdf")
-                                                new_doc = fitz.open()
-                                                new_doc.insert_pdf(doc, from_page=page_num, to_page=page_num)
-                                                for other_page_num in range(num_pages):
-                                                    other_page = doc[other_page_num]
-                                                    other_annotations = other_page.annots()
-                                                    for other_annotation in other_annotations:
-                                                        if other_annotation.type[1] == "Highlight" and closest_color(other_annotation.colors["stroke"]) == "Blue":
-                                                            new_doc.insert_pdf(doc, from_page=other_page_num, to_page=other_page_num)
-                                                            break
-                                                new_doc.save(output_file_path)
-                                                break
-                                    if has_yellow and has_blue:
-                                        break
-                                doc.close()
-        QMessageBox.information(self, "Copy Y/B Highlights", "Pages with both yellow and blue highlights copied successfully!")
+        self.copy_highlight_modes(("YB",), "Copy Y/B Highlights", "Pages with both yellow and blue highlights copied successfully!")
+
+    def copy_all_pages(self):
+        self.copy_highlight_modes(COPY_MODES, "Copy All Highlights", "Yellow, blue and Y/B highlighted pages copied successfully!")
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # Needed for worker processes in the packaged .exe
     app = QApplication([])
     window = BabyHipsGUI()
     window.show()
@@ -0,0 +1,211 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import platform
+import tempfile
+import statistics
+import subprocess
+from si_profile import PROFILE
+from si_core import LazyModule, COPY_MODES, crawl_library, library_entries, scan_highlights, extract_file_highlights, compress_library, extract_library, copy_library
+
+# Reproducible benchmark: builds a synthetic Make/Year/Model library of PDFs from a seed, then times each
+# operation end-to-end and its main stages, and writes a JSON report that can be diffed across versions.
+#   python si_cli.py bench --pages 40 --image-size 800 --repeat 3 --report bench.json
+
+MAKES = ["Honda", "Toyota", "Ford", "Nissan", "Subaru", "Mazda", "Kia", "Hyundai"]
+MODELS = ["Civic", "Camry", "Escape", "Altima", "Outback", "Cx", "Soul", "Tucson"]
+SYSTEMS = ["ACC", "LKA", "BSM", "SVC", "AEB"]
+YELLOW_RGB = (1.0, 1.0, 0.0)
+BLUE_RGB = (0.0, 0.0, 1.0)
+
+fitz = LazyModule("fitz")
+
+# Import time of the modules every launch and every worker process pays for, each measured in a fresh interpreter.
+# They must not pull in the heavy libraries, which load on first use instead.
+STARTUP_MODULES = ["si_core", "si_cli"]
+STARTUP_BUDGET = 0.5  # Seconds per module
+HEAVY_MODULES = ["fitz", "numpy", "pandas", "PyPDF2", "PyQt5"]
+STARTUP_SCRIPT = """
+import sys, json, time
+start = time.perf_counter()
+import {module}
+print(json.dumps({{"seconds": time.perf_counter() - start, "heavy": [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+def synthetic_image(rnd, size):
+    # Gradient with noisy blocks: compresses somewhat, like a scanned diagram, unlike pure noise
+    data = bytearray(size * size * 3)
+    shade = rnd.randrange(64, 192)
+    for y in range(size):
+        row = y * size * 3
+        for x in range(0, size, 8):
+            value = (shade + (x + y) // 4 + rnd.randrange(32)) % 256
+            data[row + x * 3:row + min(x + 8, size) * 3] = bytes([value]) * (min(x + 8, size) - x) * 3
+    return fitz.Pixmap(fitz.csRGB, size, size, bytes(data), False)
+
+def make_document(path, rnd, pages, image_size, yellow_density, blue_density):
+    doc = fitz.open()
+    image = synthetic_image(rnd, image_size) if image_size else None
+    for page_num in range(pages):
+        page = doc.new_page()
+        for line in range(12):
+            page.insert_text((72, 90 + line * 14), f"Step {page_num + 1}.{line + 1}: calibrate sensor {rnd.randrange(1000)} to spec")
+        if image is not None:
+            page.insert_image(fitz.Rect(72, 300, 540, 740), pixmap=image)
+        for density, rgb in ((yellow_density, YELLOW_RGB), (blue_density, BLUE_RGB)):
+            if rnd.random() < density:
+                line = rnd.randrange(12)
+                annot = page.add_highlight_annot(fitz.Rect(70, 80 + line * 14, 360, 94 + line * 14))
+                annot.set_colors(stroke=rgb)
+                annot.update()
+    doc.save(path, deflate=True)
+    doc.close()
+
+def generate_corpus(root, makes=2, years=2, models=2, files_per_model=3, pages=10, image_size=0, yellow_density=0.3, blue_density=0.2, seed=1):
+    rnd = random.Random(seed)
+    for make in MAKES[:makes]:
+        for year in range(2019, 2019 + years):
+            for model in MODELS[:models]:
+                model_path = os.path.join(root, make, str(year), model)
+                os.makedirs(model_path, exist_ok=True)
+                for file_num in range(files_per_model):
+                    system = SYSTEMS[file_num % len(SYSTEMS)]
+                    file_path = os.path.join(model_path, f"{year} {make} {model} ({system}) {file_num + 1}.pdf")
+                    make_document(file_path, rnd, pages, image_size, yellow_density, blue_density)
+    manifest = crawl_library(root)
+    return {"files": len(manifest), "bytes": sum(entry.size for entry in manifest), "pages": pages * len(manifest)}
+
+def cpu_seconds():
+    # This process plus finished worker processes (children are not reported on Windows)
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+def timed(func, *args, **kwargs):
+    start_wall = time.perf_counter()
+    start_cpu = cpu_seconds()
+    result = func(*args, **kwargs)
+    return result, {"wall": time.perf_counter() - start_wall, "cpu": cpu_seconds() - start_cpu}
+
+def scan_only(manifest):
+    for entry in library_entries(manifest):
+        doc = fitz.open(entry.path)
+        scan_highlights(doc)
+        doc.close()
+
+def text_only(manifest):
+    for entry in library_entries(manifest):
+        extract_file_highlights(entry.path)
+
+def run_once(corpus_path, work_path, workers):
+    # Fresh output folders each time so no run is served from the scan cache of an earlier one
+    timings = {}
+    manifest, timings["crawl"] = timed(crawl_library, corpus_path)
+    _, timings["scan"] = timed(scan_only, manifest)
+    _, timings["text"] = timed(text_only, manifest)
+    for name in ("extract", "copy", "compress"):
+        os.makedirs(os.path.join(work_path, name))
+    _, timings["extract-highlights"] = timed(extract_library, corpus_path, os.path.join(work_path, "extract", "Extracted Highlights.csv"), workers, manifest=manifest)
+    extract_stages = PROFILE.operation
+    _, timings["copy"] = timed(copy_library, corpus_path, os.path.join(work_path, "copy"), COPY_MODES, workers, manifest=manifest)
+    copy_stages = PROFILE.operation
+    # compress rewrites files in place, so it runs on a throwaway copy of the corpus
+    compress_path = os.path.join(work_path, "compress", "library")
+    shutil.copytree(corpus_path, compress_path)
+    _, timings["compress"] = timed(compress_library, compress_path, os.path.join(work_path, "compress"), workers)
+    for name, operation in (("extract-highlights", extract_stages), ("copy", copy_stages), ("compress", PROFILE.operation)):
+        # Stage walls summed over files, so with several workers they can add up to more than the operation's wall
+        timings[name]["stages"] = {stage: stats["wall"] for stage, stats in operation["stages"].items()}
+    return timings
+
+def measure_startup(repeat=1, budget=STARTUP_BUDGET):
+    source_path = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [source_path, os.environ.get("PYTHONPATH")])))
+    startup = {}
+    for module in STARTUP_MODULES:
+        samples = []
+        heavy = []
+        for _ in range(max(1, repeat)):
+            output = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT.format(module=module, heavy=HEAVY_MODULES)],
+                                    cwd=source_path, env=env, capture_output=True, text=True, check=True).stdout
+            sample = json.loads(output.strip().splitlines()[-1])
+            samples.append(sample["seconds"])
+            heavy = sample["heavy"]
+        seconds = statistics.median(samples)
+        startup[module] = {"seconds": seconds, "budget": budget, "within_budget": seconds <= budget and not heavy, "heavy_modules": heavy}
+    return startup
+
+def summarize(runs):
+    summary = {}
+    for name in runs[0]:
+        walls = [run[name]["wall"] for run in runs]
+        cpus = [run[name]["cpu"] for run in runs]
+        summary[name] = {"wall_min": min(walls), "wall_median": statistics.median(walls), "cpu_median": statistics.median(cpus)}
+    return summary
+
+def run_benchmark(makes=2, years=2, models=2, files_per_model=3, pages=10, image_size=0, yellow_density=0.3, blue_density=0.2, seed=1, workers=1, repeat=1, keep=None,
+                  startup_budget=STARTUP_BUDGET):
+    params = {"makes": makes, "years": years, "models": models, "files_per_model": files_per_model, "pages": pages, "image_size": image_size,
+              "yellow_density": yellow_density, "blue_density": blue_density, "seed": seed, "workers": workers, "repeat": repeat}
+    startup = measure_startup(max(3, repeat), startup_budget)  # Before this process has imported anything heavy itself
+    base_path = keep or tempfile.mkdtemp(prefix="si_bench_")
+    corpus_path = os.path.join(base_path, "corpus")
+    try:
+        if os.path.exists(corpus_path):
+            shutil.rmtree(corpus_path)
+        corpus, generate_time = timed(generate_corpus, corpus_path, makes, years, models, files_per_model, pages, image_size, yellow_density, blue_density, seed)
+        runs = []
+        for run_num in range(repeat):
+            work_path = os.path.join(base_path, f"run-{run_num + 1}")
+            if os.path.exists(work_path):
+                shutil.rmtree(work_path)
+            runs.append(run_once(corpus_path, work_path, workers))
+    finally:
+        if keep is None:
+            shutil.rmtree(base_path, ignore_errors=True)
+    return {
+        "environment": {"python": platform.python_version(), "pymupdf": fitz.VersionBind, "platform": platform.platform(), "cpus": os.cpu_count()},
+        "params": params,
+        "startup": startup,
+        "corpus": dict(corpus, generate_seconds=generate_time["wall"]),
+        "runs": runs,
+        "summary": summarize(runs),
+    }
+
+def add_bench_arguments(parser):
+    parser.add_argument("--makes", type=int, default=2)
+    parser.add_argument("--years", type=int, default=2)
+    parser.add_argument("--models", type=int, default=2)
+    parser.add_argument("--files-per-model", type=int, default=3)
+    parser.add_argument("--pages", type=int, default=10, help="Pages per document")
+    parser.add_argument("--image-size", type=int, default=0, help="Side in pixels of the image placed on every page (0 for none)")
+    parser.add_argument("--yellow-density", type=float, default=0.3, help="Chance that a page has a yellow highlight")
+    parser.add_argument("--blue-density", type=float, default=0.2, help="Chance that a page has a blue highlight")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workers", "-w", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--startup-budget", type=float, default=STARTUP_BUDGET, help="Seconds allowed for importing each core module (default: %(default)s)")
+    parser.add_argument("--keep", help="Build the corpus and outputs in this folder and leave them there")
+    parser.add_argument("--report", help="Write the JSON report here instead of printing it")
+
+def run_from_args(args):
+    report = run_benchmark(args.makes, args.years, args.models, args.files_per_model, args.pages, args.image_size,
+                           args.yellow_density, args.blue_density, args.seed, max(1, args.workers), max(1, args.repeat), args.keep,
+                           args.startup_budget)
+    text = json.dumps(report, indent=2)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as report_file:
+            report_file.write(text)
+        print(f"Benchmark report written to {args.report}")
+    else:
+        print(text)
+    for name, stats in report["summary"].items():
+        print(f"{name:>20}: {stats['wall_median']:.3f}s wall, {stats['cpu_median']:.3f}s cpu", file=sys.stderr)
+    over_budget = [module for module, stats in report["startup"].items() if not stats["within_budget"]]
+    for module, stats in report["startup"].items():
+        print(f"{'import ' + module:>20}: {stats['seconds']:.3f}s (budget {stats['budget']:.3f}s)"
+              f"{', loads ' + ', '.join(stats['heavy_modules']) if stats['heavy_modules'] else ''}", file=sys.stderr)
+    # A startup regression fails the run, so it shows up wherever the benchmark is scheduled
+    return 1 if over_budget else 0
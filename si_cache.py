@@ -0,0 +1,121 @@
+import os
+import json
+import sqlite3
+import hashlib
+
+CACHE_FILE_NAME = "SI MultiTool Cache.sqlite"
+
+def file_hash(file_path, chunk_size=1024 * 1024):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def bytes_hash(data):
+    # Same digest as file_hash, for bytes already in memory
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def head_hash(file_path, size=64 * 1024):
+    # Hash of the first bytes only: enough to tell most same-size files apart without reading them whole
+    with open(file_path, "rb") as f:
+        return hashlib.blake2b(f.read(size), digest_size=16).hexdigest()
+
+def encode_page_colors(page_colors):
+    return json.dumps({str(page_num): sorted(colors) for page_num, colors in page_colors.items()})
+
+def decode_page_colors(text):
+    return {int(page_num): set(colors) for page_num, colors in json.loads(text).items()}
+
+class ScanCache:
+    # Per-PDF scan results kept between runs, keyed on path and validated by size + mtime
+    # (falling back to a content hash when only the mtime moved).
+    def __init__(self, db_path, signature=None):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER,
+                mtime REAL,
+                hash TEXT,
+                page_colors TEXT,
+                highlights TEXT
+            )""")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        if signature is not None:
+            # Colors and rows classified with a different palette are stale even for unchanged files
+            row = self.conn.execute("SELECT value FROM meta WHERE key = 'signature'").fetchone()
+            if row is None or row[0] != signature:
+                self.conn.execute("UPDATE files SET page_colors = NULL, highlights = NULL")
+                self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('signature', ?)", (signature,))
+        self.conn.commit()
+
+    @classmethod
+    def for_output(cls, output_dir, signature=None):
+        return cls(os.path.join(output_dir, CACHE_FILE_NAME), signature)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def _row(self, file_path):
+        return self.conn.execute("SELECT size, mtime, hash, page_colors, highlights FROM files WHERE path = ?", (file_path,)).fetchone()
+
+    def _current_row(self, file_path, size=None, mtime=None):
+        # The stored row if it still describes the file on disk, otherwise None.
+        # size/mtime from a crawl manifest save a stat call per file.
+        row = self._row(file_path)
+        if row is None:
+            return None
+        if size is None or mtime is None:
+            stat = os.stat(file_path)
+            size, mtime = stat.st_size, stat.st_mtime
+        if row[0] == size and row[1] == mtime:
+            return row
+        if row[0] == size and row[2] is not None and row[2] == file_hash(file_path):
+            # Touched but not changed (copied back, restored from backup, ...)
+            self.conn.execute("UPDATE files SET mtime = ? WHERE path = ?", (mtime, file_path))
+            return row
+        return None
+
+    def lookup(self, file_path, size=None, mtime=None):
+        # {"page_colors": ..., "highlights": ...} for an unchanged file; either value may be None if never scanned
+        try:
+            row = self._current_row(file_path, size, mtime)
+        except OSError:
+            return None
+        if row is None:
+            return None
+        return {"page_colors": decode_page_colors(row[3]) if row[3] is not None else None,
+                "highlights": json.loads(row[4]) if row[4] is not None else None}
+
+    def store(self, file_path, page_colors=None, highlights=None, content_hash=None):
+        # content_hash is taken by the worker that parsed the file (see open_pdf), so the file is never read here.
+        # Results stored without one (no highlight annotations at all, cheap to redo) are simply scanned again
+        # once the file's mtime moves.
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return
+        row = self._row(file_path)
+        if row is not None and row[0] == stat.st_size and (row[1] == stat.st_mtime or (content_hash is not None and row[2] == content_hash)):
+            # Same content: what is recorded for it stays and is added to
+            self.conn.execute("UPDATE files SET mtime = ?, hash = COALESCE(hash, ?) WHERE path = ?", (stat.st_mtime, content_hash, file_path))
+        else:
+            # New or changed file: anything recorded for the old content is dropped
+            self.conn.execute("INSERT OR REPLACE INTO files (path, size, mtime, hash, page_colors, highlights) VALUES (?, ?, ?, ?, NULL, NULL)",
+                              (file_path, stat.st_size, stat.st_mtime, content_hash))
+        if page_colors is not None:
+            self.conn.execute("UPDATE files SET page_colors = ? WHERE path = ?", (encode_page_colors(page_colors), file_path))
+        if highlights is not None:
+            self.conn.execute("UPDATE files SET highlights = ? WHERE path = ?", (json.dumps(highlights), file_path))
+
+    def commit(self):
+        self.conn.commit()
@@ -0,0 +1,193 @@
+import os
+import sys
+import json
+import argparse
+import cProfile
+import pstats
+import signal
+import threading
+import multiprocessing
+from si_bench import add_bench_arguments, run_from_args
+from si_search import SEARCH_LIMIT, search_highlights
+from si_shard import LEASE_SECONDS, run_distributed
+from si_watch import DEBOUNCE_SECONDS, POLL_SECONDS, watch_library
+from si_core import COPY_MODES, SPLIT_PART_KB, COMPRESSION_PRESETS, DEFAULT_PRESET, DEFAULT_PALETTE, ColorClassifier, parse_palette, default_workers, compress_library, extract_library, copy_library, write_run_report
+
+# Headless entry point: the same operations as the BabyHipsGUI buttons, without PyQt5.
+#   python si_cli.py compress "D:\OEM" --output "D:\Reports"
+#   python si_cli.py extract-highlights "D:\OEM" --output "D:\Reports" --workers 6
+#   python si_cli.py copy "D:\OEM" --output "D:\Copies" --color yb --report copy.json
+#   python si_cli.py extract-highlights "Z:\OEM" --output "Z:\Reports" --ledger "Z:\Reports\ledger"   (on every machine)
+#   python si_cli.py watch "D:\OEM" --output "D:\Reports" --copy-to "D:\Copies"
+#   python si_cli.py bench --pages 40 --image-size 800 --report bench.json
+#   python si_cli.py search "D:\Reports" calibration --year 2019 --color yellow
+
+COLOR_MODES = {"yellow": ("Yellow",), "blue": ("Blue",), "yb": ("YB",), "all": COPY_MODES,
+               "both": ("Both",), "yellow-only": ("YellowOnly",), "blue-only": ("BlueOnly",)}
+
+def print_progress(done, total, file_path, fraction=None):
+    if file_path:
+        print(f"[{done}/{total}{f', {fraction:.0%} of the work' if fraction is not None else ''}] {file_path}")
+
+def print_error(file_path, message):
+    print(f"Error while processing {file_path}: {message}", file=sys.stderr)
+
+def palette_argument(text):
+    try:
+        return parse_palette(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="si_cli", description="S.I. Multi-Tool batch operations without the GUI.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_common(subparser, output_help):
+        subparser.add_argument("input", help="Library folder laid out as Make/Year/Model")
+        subparser.add_argument("--output", "-o", help=output_help)
+        subparser.add_argument("--workers", "-w", type=int, default=default_workers(), help="Worker processes (default: %(default)s)")
+        subparser.add_argument("--report", help="Write a per-file report; .json for JSON, anything else for CSV")
+        subparser.add_argument("--memory-limit-mb", type=int, help="Resident memory ceiling per worker; large PDFs past it are handled in slower streaming mode")
+        subparser.add_argument("--profile", metavar="PATH", help="Dump cProfile stats of this process to PATH (use --workers 1 to include the per-file work)")
+
+    def add_distributed(subparser):
+        subparser.add_argument("--ledger", help="Shared folder through which several machines split the library; run the same command on each")
+        subparser.add_argument("--lease-seconds", type=int, default=LEASE_SECONDS, help="How long a crashed machine's shard stays claimed (default: %(default)s)")
+
+    def add_palette(subparser):
+        subparser.add_argument("--palette", type=palette_argument, help='Highlight colors as "Name=r,g,b;..." with 0-1 values (default: Yellow and Blue)')
+        subparser.add_argument("--max-color-distance", type=float, help="Highlights further than this from every palette color are reported as Unknown")
+
+    compress_parser = subparsers.add_parser("compress", help="Compress PDFs in place and split oversized ones")
+    add_common(compress_parser, "Folder for oversized_files_report.csv (default: the input folder)")
+    compress_parser.add_argument("--preset", choices=sorted(COMPRESSION_PRESETS), default=DEFAULT_PRESET, help="lossless keeps images as-is; email/archive downsample them (default: %(default)s)")
+    compress_parser.add_argument("--max-part-kb", type=int, default=SPLIT_PART_KB, help="Size ceiling for each split part (default: %(default)s)")
+    add_distributed(compress_parser)
+    extract_parser = subparsers.add_parser("extract-highlights", help="Write Extracted Highlights.csv")
+    add_common(extract_parser, "Folder for Extracted Highlights.csv (default: the input folder)")
+    add_palette(extract_parser)
+    add_distributed(extract_parser)
+    copy_parser = subparsers.add_parser("copy", help="Copy highlighted pages into _Yellow/_Blue/_YB PDFs")
+    add_common(copy_parser, "Folder for the copied PDFs")
+    copy_parser.add_argument("--color", "-c", type=str.lower, default="all", help="yellow, blue, yb (either), both, yellow-only, blue-only, all, or any --palette name / name-only (default: %(default)s)")
+    add_palette(copy_parser)
+    watch_parser = subparsers.add_parser("watch", help="Keep running and process PDFs as they are added or changed")
+    add_common(watch_parser, "Folder for Extracted Highlights.csv, oversized_files_report.csv and the watch state (default: the input folder)")
+    watch_parser.add_argument("--no-compress", action="store_true", help="Do not compress or split new PDFs")
+    watch_parser.add_argument("--no-extract", action="store_true", help="Do not add new highlights to Extracted Highlights.csv")
+    watch_parser.add_argument("--copy-to", help="Also copy the highlighted pages of new PDFs into this folder")
+    watch_parser.add_argument("--color", "-c", type=str.lower, default="all", help="Which pages --copy-to copies, as for copy (default: %(default)s)")
+    watch_parser.add_argument("--preset", choices=sorted(COMPRESSION_PRESETS), default=DEFAULT_PRESET)
+    watch_parser.add_argument("--max-part-kb", type=int, default=SPLIT_PART_KB)
+    watch_parser.add_argument("--debounce-seconds", type=float, default=DEBOUNCE_SECONDS, help="How long a file must stay unchanged before it is processed (default: %(default)s)")
+    watch_parser.add_argument("--poll", action="store_true", help="Re-crawl instead of using filesystem events (for network drives that send none)")
+    watch_parser.add_argument("--poll-seconds", type=float, default=POLL_SECONDS, help="Seconds between re-crawls when polling (default: %(default)s)")
+    add_palette(watch_parser)
+    add_bench_arguments(subparsers.add_parser("bench", help="Time every operation on a generated library and report JSON"))
+    search_parser = subparsers.add_parser("search", help="Search the highlights indexed by extract-highlights")
+    search_parser.add_argument("index", help="Folder holding Extracted Highlights.csv, or the index file itself")
+    search_parser.add_argument("query", nargs="?", default="", help="Words that must all appear; end a word with * to match any ending")
+    for column in ("year", "make", "model", "system", "color"):
+        search_parser.add_argument(f"--{column}")
+    search_parser.add_argument("--limit", type=int, default=SEARCH_LIMIT, help="Most matches to show (default: %(default)s)")
+    search_parser.add_argument("--json", action="store_true", help="Print the matches as JSON")
+    return parser
+
+def run_search(args):
+    try:
+        matches = search_highlights(args.index, args.query, args.limit, year=args.year, make=args.make, model=args.model, system=args.system, color=args.color)
+    except FileNotFoundError as e:
+        print(str(e), file=sys.stderr)
+        return 2
+    if args.json:
+        print(json.dumps(matches, indent=2))
+        return 0
+    for match in matches:
+        print(f"{match['Year']} {match['Make']} {match['Model']} ({match['System']}) page {match['Page']} [{match['HighlightColor']}] {match['Text']}")
+        print(f"    {match['File']}")
+    print(f"{len(matches)} matches", file=sys.stderr)
+    return 0
+
+def copy_modes(color, classifier):
+    palette_modes = {name.lower(): (name,) for name in classifier.names}
+    palette_modes.update({f"{name.lower()}-only": (f"{name}Only",) for name in classifier.names})
+    modes = COLOR_MODES.get(color) or palette_modes.get(color)
+    if modes is None:
+        print(f"Unknown color {color}; choose from {', '.join(sorted(set(COLOR_MODES) | set(palette_modes)))}", file=sys.stderr)
+    return modes
+
+def run_watch(args, output_dir, workers, classifier):
+    modes = copy_modes(args.color, classifier)
+    if modes is None:
+        return None
+    # Ctrl+C stops after the files in progress, so the state and reports are left complete
+    stopped = threading.Event()
+    signal.signal(signal.SIGINT, lambda *_: stopped.set())
+    return watch_library(args.input, output_dir, compress=not args.no_compress, extract=not args.no_extract, copy_to=args.copy_to, modes=modes, workers=workers,
+                         progress=print_progress, cancelled=stopped.is_set, on_error=print_error, classifier=classifier, max_part_kb=args.max_part_kb,
+                         preset=args.preset, memory_limit_mb=args.memory_limit_mb, debounce_seconds=args.debounce_seconds, poll_seconds=args.poll_seconds,
+                         use_events=not args.poll)
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == "bench":
+        return run_from_args(args)
+    if args.command == "search":
+        return run_search(args)
+    if args.profile:
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(run_command, args)
+        finally:
+            profiler.dump_stats(args.profile)
+            pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
+            print(f"Profile written to {args.profile}")
+    return run_command(args)
+
+def run_command(args):
+    if not os.path.isdir(args.input):
+        print(f"Input folder not found: {args.input}", file=sys.stderr)
+        return 2
+    output_dir = args.output or args.input
+    os.makedirs(output_dir, exist_ok=True)
+    workers = max(1, args.workers)
+    classifier = None
+    if args.command != "compress":
+        palette = args.palette or DEFAULT_PALETTE
+        classifier = ColorClassifier(palette, args.max_color_distance)
+    if getattr(args, "ledger", None):
+        try:
+            records = run_distributed(args.command, args.input, output_dir, args.ledger, workers=workers, progress=print_progress, on_error=print_error,
+                                      classifier=classifier, max_part_kb=getattr(args, "max_part_kb", SPLIT_PART_KB), preset=getattr(args, "preset", DEFAULT_PRESET),
+                                      memory_limit_mb=args.memory_limit_mb, lease_seconds=args.lease_seconds)
+        except ValueError as e:
+            print(str(e), file=sys.stderr)
+            return 2
+    elif args.command == "compress":
+        records = compress_library(args.input, output_dir, workers=workers, progress=print_progress, on_error=print_error, max_part_kb=args.max_part_kb,
+                                   preset=args.preset, memory_limit_mb=args.memory_limit_mb)
+    elif args.command == "extract-highlights":
+        records = extract_library(args.input, os.path.join(output_dir, "Extracted Highlights.csv"), workers=workers, progress=print_progress, on_error=print_error,
+                                  classifier=classifier, memory_limit_mb=args.memory_limit_mb)
+    elif args.command == "watch":
+        records = run_watch(args, output_dir, workers, classifier)
+        if records is None:
+            return 2
+    else:
+        if not args.output:
+            print("copy needs --output so copies are not written into the library", file=sys.stderr)
+            return 2
+        modes = copy_modes(args.color, classifier)
+        if modes is None:
+            return 2
+        records = copy_library(args.input, output_dir, modes, workers=workers, progress=print_progress, on_error=print_error, classifier=classifier,
+                               memory_limit_mb=args.memory_limit_mb)
+    if args.report:
+        print(f"Report written to {write_run_report(records, args.report)}")
+    failed = sum(1 for record in records if record["Status"] == "failed")
+    print(f"{len(records)} files processed, {failed} failed")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
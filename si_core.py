@@ -0,0 +1,1475 @@
+import os
+import re
+import gc
+import json
+import string
+import csv
+import shutil
+import socket
+import importlib
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from si_cache import ScanCache, file_hash, head_hash, bytes_hash
+try:
+    import psutil
+except ImportError:
+    psutil = None  # Optional: without it the memory limit is only enforced where /proc/self/statm exists
+from si_profile import PROFILE, profiled_call, write_run_summary
+from si_pipeline import PIPELINE, Prefetcher, BackgroundWriter, prefetch_budget_mb
+from si_search import HighlightIndex
+
+class LazyModule:
+    # Stands in for a heavy module and imports it on first use, so importing si_core (the GUI, the CLI, every
+    # worker process) stays fast and PyMuPDF/numpy are only loaded once an operation actually needs them
+    def __init__(self, name):
+        self.name = name
+        self.module = None
+
+    def __getattr__(self, attr):
+        if self.module is None:
+            self.module = importlib.import_module(self.name)
+        return getattr(self.module, attr)
+
+fitz = LazyModule("fitz")
+np = LazyModule("numpy")
+
+YELLOW = (1.0, 1.0, 0.0)
+BLUE = (0.0, 0.0, 1.0)
+
+DEFAULT_PALETTE = {"Yellow": YELLOW, "Blue": BLUE}
+UNKNOWN_COLOR = "Unknown"
+
+def to_rgb(color):
+    # Annotation colors can be gray (1 value), RGB (3) or CMYK (4); anything else has no usable color
+    if not color:
+        return None
+    if len(color) == 1:
+        return (color[0], color[0], color[0])
+    if len(color) == 4:
+        c, m, y, k = color
+        return ((1 - c) * (1 - k), (1 - m) * (1 - k), (1 - y) * (1 - k))
+    if len(color) == 3:
+        return tuple(color)
+    return None
+
+class ColorClassifier:
+    # Maps annotation colors to the nearest palette name. Colors further than max_distance from every
+    # palette entry are UNKNOWN_COLOR; max_distance=None always picks the nearest entry.
+    def __init__(self, palette=None, max_distance=None):
+        palette = palette or DEFAULT_PALETTE
+        self.names = list(palette)
+        self.rgb = [[float(value) for value in palette[name]] for name in self.names]
+        self.centers = None  # numpy array of self.rgb, built on the first classify()
+        self.max_distance = max_distance
+        self.cache = {}  # RGB triple -> name
+
+    def signature(self):
+        # Identifies the palette in cached scan results, which are only valid for the palette that produced them
+        return json.dumps({"palette": dict(zip(self.names, self.rgb)), "max_distance": self.max_distance}, sort_keys=True)
+
+    def classify(self, colors):
+        # One vectorized distance computation for every not-yet-seen triple in colors
+        keys = [to_rgb(color) for color in colors]
+        missing = list({key for key in keys if key is not None and key not in self.cache})
+        if missing:
+            if self.centers is None:
+                self.centers = np.array(self.rgb, dtype=float)
+            distances = np.linalg.norm(np.array(missing, dtype=float)[:, None, :] - self.centers[None, :, :], axis=2)
+            nearest = distances.argmin(axis=1)
+            nearest_distances = distances[np.arange(len(missing)), nearest]
+            for key, index, distance in zip(missing, nearest, nearest_distances):
+                if self.max_distance is not None and distance > self.max_distance:
+                    self.cache[key] = UNKNOWN_COLOR
+                else:
+                    self.cache[key] = self.names[index]
+        return [self.cache[key] if key is not None else UNKNOWN_COLOR for key in keys]
+
+default_classifier = ColorClassifier()
+
+def parse_palette(text):
+    # "Yellow=1,1,0;Blue=0,0,1;Green=0,1,0" -> {"Yellow": (1.0, 1.0, 0.0), ...}; raises ValueError on anything else
+    palette = {}
+    for entry in text.split(";"):
+        if not entry.strip():
+            continue
+        name, _, values = entry.partition("=")
+        try:
+            rgb = tuple(float(value) for value in values.split(","))
+        except ValueError:
+            rgb = ()
+        if not name.strip() or len(rgb) != 3 or not all(0 <= value <= 1 for value in rgb):
+            raise ValueError(f'Palette entry "{entry.strip()}" is not name=r,g,b with three values from 0 to 1')
+        palette[name.strip()] = rgb
+    if not palette:
+        raise ValueError("The palette has no colors")
+    return palette
+
+COPY_MODES = ("Yellow", "Blue", "YB")
+
+ManifestEntry = namedtuple("ManifestEntry", ["path", "make", "year", "model", "system", "size", "mtime"])
+
+def entry_from_levels(file_path, levels, size=None, mtime=None):
+    # levels are the folder names between the library root and the file
+    match = re.search(r'\((.*?)\)', os.path.basename(file_path))
+    make, year, model = levels[:3] if len(levels) >= 3 else (None, None, None)
+    return ManifestEntry(file_path, make, year, model, match.group(1) if match else "N/A", size, mtime)
+
+def manifest_entry(input_path, file_path, size=None, mtime=None):
+    # The entry crawl_library gives file_path, for callers that only have the path (watch mode, merged shards)
+    relative_dir = os.path.dirname(os.path.relpath(file_path, input_path))
+    return entry_from_levels(file_path, tuple(relative_dir.split(os.sep)) if relative_dir else (), size, mtime)
+
+def crawl_library(input_path):
+    # One os.scandir traversal of the whole tree. Every PDF gets an entry; make/year/model are the first three
+    # folder levels below input_path (None for PDFs sitting above the Model level) and system is the "(...)"
+    # in the file name. Entries are in sorted path order so runs over the same tree line up. Like os.walk, it does
+    # not follow symlinked folders, and a PDF that disappears while the folder is read is skipped.
+    manifest = []
+    stack = [(input_path, ())]
+    while stack:
+        dir_path, levels = stack.pop()
+        try:
+            entries = sorted(os.scandir(dir_path), key=lambda entry: entry.name)
+        except OSError as e:
+            print(f"Could not read {dir_path}: {str(e)}")
+            continue
+        sub_dirs = []
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                sub_dirs.append((entry.path, levels + (entry.name,)))
+            elif entry.name.lower().endswith(".pdf"):
+                try:
+                    stat = entry.stat()  # Served from the directory listing on Windows, no extra round trip
+                except OSError:
+                    continue  # Deleted or renamed since the listing, or a broken link
+                manifest.append(entry_from_levels(entry.path, levels, stat.st_size, stat.st_mtime))
+        stack.extend(reversed(sub_dirs))
+    manifest.sort(key=lambda entry: entry.path)
+    return manifest
+
+def library_entries(manifest):
+    # The PDFs that live inside a Make/Year/Model folder, which is what the highlight operations work on
+    return [entry for entry in manifest if entry.model is not None]
+
+def content_groups(entries):
+    # Groups byte-identical files: a list of position lists into entries, each group in crawl order and the groups
+    # ordered by their first file. Only files that share a size are read at all, and only files that also share
+    # their first 64 KB are hashed whole.
+    with PROFILE.stage("dedup") as counts:
+        by_size = {}
+        for position, entry in enumerate(entries):
+            by_size.setdefault(entry.size, []).append(position)
+        keys = {}
+        for size, positions in by_size.items():
+            if len(positions) == 1:
+                keys[positions[0]] = (size,)
+                continue
+            by_head = {}
+            for position in positions:
+                try:
+                    by_head.setdefault(head_hash(entries[position].path), []).append(position)
+                except OSError:
+                    keys[position] = (size, entries[position].path)  # Unreadable: never anyone's duplicate
+            for head, same_head in by_head.items():
+                if len(same_head) == 1:
+                    keys[same_head[0]] = (size, head)
+                    continue
+                for position in same_head:
+                    counts["bytes_read"] += entries[position].size
+                    try:
+                        keys[position] = (size, head, file_hash(entries[position].path))
+                    except OSError:
+                        keys[position] = (size, entries[position].path)
+        groups = {}
+        for position in range(len(entries)):
+            groups.setdefault(keys[position], []).append(position)
+    return list(groups.values())
+
+def copy_file_atomic(source_path, target_path):
+    shutil.copyfile(source_path, target_path + ".tmp")
+    os.replace(target_path + ".tmp", target_path)
+
+PAGE_WINDOW = 100  # Pages handled between memory checks when a memory limit is set
+
+def current_rss_mb():
+    # Resident memory of this process in MB, or None where it can't be measured
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+class MemoryGuard:
+    # Per-worker RSS ceiling, checked between page windows. Over the limit it first drops MuPDF's object
+    # store and Python garbage; if that is not enough, streaming is set and stays set for the document so
+    # the caller can switch to its slower path that keeps less in memory.
+    def __init__(self, limit_mb=None, window=PAGE_WINDOW):
+        self.limit_mb = limit_mb
+        self.window = window
+        self.streaming = False
+
+    def window_end(self, page_num):
+        return self.limit_mb is not None and (page_num + 1) % self.window == 0
+
+    def check(self):
+        if self.limit_mb is None or self.streaming:
+            return self.streaming
+        rss = current_rss_mb()
+        if rss is None or rss <= self.limit_mb:
+            return False
+        gc.collect()
+        fitz.TOOLS.store_shrink(100)
+        rss = current_rss_mb()
+        self.streaming = rss > self.limit_mb
+        return self.streaming
+
+def window_ranges(ranges, window):
+    # Cuts (first, last) page ranges so none is longer than window pages
+    for first_page, last_page in ranges:
+        while last_page - first_page + 1 > window:
+            yield first_page, first_page + window - 1
+            first_page += window
+        yield first_page, last_page
+
+PRINTABLE_FILTER = re.compile("[^" + re.escape(string.printable) + "]")
+
+def annotation_color(doc, xref):
+    # The /C entry of an annotation dictionary (its stroke color) without loading the annotation
+    kind, value = doc.xref_get_key(xref, "C")
+    if kind != "array":
+        return []
+    try:
+        return [float(component) for component in value.strip("[]").split()]
+    except ValueError:
+        return []
+
+def page_highlight_strokes(doc, page):
+    # Annotation-only view of a page: the stroke color of each Highlight, read from the annotation
+    # dictionaries directly so no Annot objects, appearance streams or page text are touched
+    return [annotation_color(doc, xref) for xref, annot_type, _ in page.annot_xrefs() if annot_type == fitz.PDF_ANNOT_HIGHLIGHT]
+
+def scan_highlights(doc, classifier=None, guard=None):
+    # Classify every Highlight annotation once: {page_num: {"Yellow", "Blue"}}
+    classifier = classifier or default_classifier
+    guard = guard or MemoryGuard()
+    page_colors = {}
+    with PROFILE.stage("scan", pages=len(doc)) as counts:
+        for page_num in range(len(doc)):
+            strokes = page_highlight_strokes(doc, doc[page_num])
+            if strokes:
+                counts["annotations"] += len(strokes)
+                page_colors[page_num] = set(classifier.classify(strokes))
+            if guard.window_end(page_num):
+                guard.check()
+    return page_colors
+
+def open_pdf(file_path, hashes=None, memory_limit_mb=None):
+    # fitz.open timed as the "open" stage; the file size stands in for bytes read.
+    # Inside iter_pipelined the bytes were usually read ahead already and the document opens from memory.
+    # hashes, when given, gets file_path -> content hash for the scan cache, taken from the same bytes: files up
+    # to the read-ahead budget are read into memory for it, larger ones are hashed from disk here in the worker.
+    with PROFILE.stage("open") as counts:
+        data = PIPELINE.prefetched(file_path)
+        if not data and hashes is not None and os.path.getsize(file_path) <= prefetch_budget_mb(memory_limit_mb) * 1024 * 1024:
+            with open(file_path, "rb") as pdf_file:
+                data = pdf_file.read()
+        doc = fitz.open(stream=data, filetype="pdf") if data else fitz.open(file_path)
+        counts["bytes_read"] = len(data) if data else os.path.getsize(file_path)
+        counts["pages"] = len(doc)
+    if hashes is not None:
+        hashes[file_path] = bytes_hash(data) if data else file_hash(file_path)
+    return doc
+
+def save_pdf(doc, output_file_path, background=False, **options):
+    # background=True is for outputs nothing reads back in the same job: inside iter_pipelined they are
+    # serialized here and written to disk by the writer thread
+    with PROFILE.stage("save", pages=len(doc)) as counts:
+        if background and PIPELINE.writer is not None:
+            data = doc.tobytes(**options)
+            PIPELINE.writer.write(output_file_path, data)
+            counts["bytes_written"] = len(data)
+        else:
+            doc.save(output_file_path, **options)
+            counts["bytes_written"] = os.path.getsize(output_file_path)
+
+# Triage: how many Highlight annotations and pages a PDF has, without loading a single page. Only the xref, the
+# page tree and the annotation dictionaries each page's /Annots lists are read, a small part of a large file.
+OBJECT_REFERENCE = re.compile(r"(\d+) \d+ R\b")
+
+def page_annotation_xrefs(doc, page_xref):
+    kind, value = doc.xref_get_key(page_xref, "Annots")
+    if kind == "xref":
+        value = doc.xref_object(int(value.split()[0]), compressed=True)  # The array is an object of its own
+    elif kind != "array":
+        return []
+    return [int(xref) for xref in OBJECT_REFERENCE.findall(value)]
+
+def triage_file(file_path):
+    # {"annotations", "pages"}; annotations == 0 means there is nothing to extract or copy. Errs on the side of
+    # a highlight: a file that can't be triaged goes through the full scan, which reports the problem.
+    with PROFILE.stage("triage") as counts:
+        try:
+            doc = fitz.open(file_path)
+            try:
+                if not doc.is_pdf:
+                    return {"annotations": 1, "pages": None}
+                pages = doc.page_count
+                annotations = sum(1 for page_num in range(pages) for xref in page_annotation_xrefs(doc, doc.page_xref(page_num))
+                                  if doc.xref_get_key(xref, "Subtype") == ("name", "/Highlight"))
+            finally:
+                doc.close()
+        except Exception:
+            return {"annotations": 1, "pages": None}
+        counts["pages"] = pages
+        counts["annotations"] = annotations
+    return {"annotations": annotations, "pages": pages}
+
+def triage_files(file_paths, workers=1, cancelled=None, file_counts=None):
+    # Set of indexes into file_paths whose files have no Highlight annotation. file_counts, when given, is
+    # filled with index -> triage_file() counts for the cost estimates.
+    skipped = set()
+    for index, counts, error in iter_parallel(triage_file, [(file_path,) for file_path in file_paths], workers, cancelled, record_files=False):
+        if error:
+            continue
+        if file_counts is not None:
+            file_counts[index] = counts
+        if not counts["annotations"]:
+            skipped.add(index)
+    return skipped
+
+def words_in_rects(words, rects):
+    # Splits the output of one page.get_text("words") call between highlight rects: a word belongs to
+    # every rect that contains its center. Returns one list of words (in reading order) per rect.
+    if not words or not rects:
+        return [[] for rect in rects]
+    boxes = np.array([word[:4] for word in words], dtype=float)
+    centers_x = (boxes[:, 0] + boxes[:, 2]) / 2
+    centers_y = (boxes[:, 1] + boxes[:, 3]) / 2
+    bounds = np.array([tuple(rect) for rect in rects], dtype=float)
+    inside = ((centers_x >= bounds[:, 0:1]) & (centers_x <= bounds[:, 2:3])
+              & (centers_y >= bounds[:, 1:2]) & (centers_y <= bounds[:, 3:4]))
+    return [[words[index][4] for index in np.flatnonzero(row)] for row in inside]
+
+class PageColorIndex:
+    # One pass over a file's {page_num: colors}: a bitmask per page (one bit per color) and the set of pages
+    # per color. Copy modes are answered from those with set operations:
+    #   "Yellow", "Blue", any palette name   pages with that color
+    #   "YB"                                 union of yellow and blue pages, only when the file has both colors
+    #   "Both"                               pages with both a yellow and a blue highlight
+    #   "YellowOnly", "<name>Only"           pages whose only highlight color is that one
+    def __init__(self, page_colors):
+        self.bits = {}  # color -> bit
+        self.masks = {}  # page_num -> mask
+        self.pages = {}  # color -> page numbers
+        for page_num, colors in page_colors.items():
+            mask = 0
+            for color in colors:
+                mask |= self.bits.setdefault(color, 1 << len(self.bits))
+                self.pages.setdefault(color, set()).add(page_num)
+            self.masks[page_num] = mask
+
+    def mask(self, colors):
+        # None when the file has no page with one of the colors
+        mask = 0
+        for color in colors:
+            if color not in self.bits:
+                return None
+            mask |= self.bits[color]
+        return mask
+
+    def any_of(self, colors):
+        return set().union(*(self.pages.get(color, set()) for color in colors))
+
+    def all_of(self, colors):
+        mask = self.mask(colors)
+        if mask is None:
+            return set()
+        return {page_num for page_num in self.pages[colors[0]] if self.masks[page_num] & mask == mask}
+
+    def only(self, color):
+        if color not in self.bits:
+            return set()
+        return {page_num for page_num in self.pages[color] if self.masks[page_num] == self.bits[color]}
+
+    def select(self, mode):
+        # Sorted page numbers for a copy mode, so each output is written once in page order
+        if mode == "YB":
+            if self.mask(("Yellow", "Blue")) is None:
+                return []
+            return sorted(self.any_of(("Yellow", "Blue")))
+        if mode == "Both":
+            return sorted(self.all_of(("Yellow", "Blue")))
+        if mode.endswith("Only") and mode not in self.bits:
+            return sorted(self.only(mode[:-len("Only")]))
+        return sorted(self.pages.get(mode, ()))
+
+def highlight_output_path(file_path, output_path, mode):
+    return os.path.join(output_path, f"{os.path.splitext(os.path.basename(file_path))[0]}_{mode}.pdf")
+
+def highlight_outputs_current(file_path, output_path, modes, page_colors, source_mtime=None):
+    # True when every copy this file should produce already exists and is newer than the file itself
+    if source_mtime is None:
+        source_mtime = os.path.getmtime(file_path)
+    for mode in collect_highlight_pages(page_colors, modes):
+        output_file_path = highlight_output_path(file_path, output_path, mode)
+        if not os.path.exists(output_file_path) or os.path.getmtime(output_file_path) < source_mtime:
+            return False
+    return True
+
+def collect_highlight_pages(page_colors, modes=COPY_MODES):
+    # {mode: sorted, de-duplicated page numbers} for every mode that has at least one page
+    index = PageColorIndex(page_colors)
+    page_sets = {}
+    for mode in modes:
+        pages = index.select(mode)
+        if pages:
+            page_sets[mode] = pages
+    return page_sets
+
+def page_ranges(pages):
+    # [0, 1, 2, 6, 7] -> [(0, 2), (6, 7)] so each run of pages is a single insert_pdf call
+    ranges = []
+    for page_num in pages:
+        if ranges and page_num == ranges[-1][1] + 1:
+            ranges[-1] = (ranges[-1][0], page_num)
+        else:
+            ranges.append((page_num, page_num))
+    return ranges
+
+def write_highlight_copies(doc, file_path, page_colors, output_path, modes=COPY_MODES, guard=None):
+    # One output document and one save per source file and mode, however many highlights matched.
+    # Over the memory limit the copy is streamed instead: each window is appended to the file on disk
+    # with an incremental save and the document reopened, so only one window is held at a time.
+    guard = guard or MemoryGuard()
+    written = []
+    for mode, pages in collect_highlight_pages(page_colors, modes).items():
+        output_file_path = highlight_output_path(file_path, output_path, mode)
+        new_doc = fitz.open()
+        streamed = False
+        with PROFILE.stage("insert_pdf", pages=len(pages)):
+            for from_page, to_page in window_ranges(page_ranges(pages), guard.window):
+                new_doc.insert_pdf(doc, from_page=from_page, to_page=to_page)
+                if guard.limit_mb is not None and guard.check():
+                    if streamed:
+                        save_pdf(new_doc, output_file_path, incremental=True, encryption=fitz.PDF_ENCRYPT_KEEP)
+                    else:
+                        save_pdf(new_doc, output_file_path, deflate=True)
+                        streamed = True
+                    new_doc.close()
+                    fitz.TOOLS.store_shrink(100)
+                    new_doc = fitz.open(output_file_path)
+        if streamed:
+            # Fonts and images shared between windows are stored once per window; no garbage pass at the end
+            # because that would load the whole copy again
+            save_pdf(new_doc, output_file_path, incremental=True, encryption=fitz.PDF_ENCRYPT_KEEP)
+        else:
+            save_pdf(new_doc, output_file_path, True, garbage=4, deflate=True, clean=True)
+        new_doc.close()
+        written.append(output_file_path)
+    return written
+
+def copy_highlighted_pages(file_path, output_path, modes=COPY_MODES, page_colors=None, classifier=None, memory_limit_mb=None, hashes=None):
+    # Opens the PDF once; page_colors from an earlier scan skips the annotation pass
+    if page_colors is not None and not collect_highlight_pages(page_colors, modes):
+        return page_colors
+    try:
+        doc = open_pdf(file_path, hashes, memory_limit_mb)
+    except:
+        print(f"Could not open {file_path}, skipping...")
+        return None
+    guard = MemoryGuard(memory_limit_mb)
+    try:
+        if page_colors is None:
+            page_colors = scan_highlights(doc, classifier, guard)
+        write_highlight_copies(doc, file_path, page_colors, output_path, modes, guard)
+    finally:
+        doc.close()
+    return page_colors
+
+def copy_file_job(file_path, output_path, modes=COPY_MODES, page_colors=None, classifier=None, memory_limit_mb=None):
+    # copy_highlighted_pages for copy_library: (page_colors, content hash or None), the hash taken in the worker
+    hashes = {}
+    return copy_highlighted_pages(file_path, output_path, modes, page_colors, classifier, memory_limit_mb, hashes), hashes.get(file_path)
+
+def extract_info_from_filename(file_path):
+    _, filename = os.path.split(file_path)
+    matches = re.findall(r'\b\d+\b|\b[A-Z][a-z]*\b', filename)
+    year = matches[0] if matches else "N/A"
+    make = matches[1] if len(matches) > 1 else "N/A"
+    model_match = re.search(r'\b[A-Z][a-zA-Z0-9 ]*\b', filename)
+    model = model_match.group() if model_match else "N/A"
+    model = model.replace(make, '').strip()
+    match = re.search(r'\((.*?)\)', filename)
+    system = match.group(1) if match else "N/A"
+    return year, make, model, system
+
+def relabel_highlights(highlights, source_path, file_path):
+    # Rows of a byte-identical copy: the same highlights, with Year/Make/Model/System taken from its own name
+    source_info = extract_info_from_filename(source_path)
+    year, make, model, system = extract_info_from_filename(file_path)
+    relabelled = []
+    for row in highlights:
+        if (row["Year"], row["Make"], row["Model"], row["System"]) == source_info:
+            row = dict(row, Year=year, Make=make, Model=model, System=system)
+        relabelled.append(row)
+    return relabelled
+
+OPEN_FAILED_ROW = {"Year": "N/A", "Make": "N/A", "Model": "N/A", "System": "N/A", "Text": "Could not open file.", "HighlightColor": "N/A", "Page": "N/A"}
+
+def extract_file_highlights(file_path, classifier=None, memory_limit_mb=None, hashes=None):
+    # Rows for "Extracted Highlights.csv"; Year/Make/Model come from the file name.
+    # None when the file can't be opened, which may only be the network share for a moment: callers report it
+    # as failed and never cache it.
+    try:
+        doc = open_pdf(file_path, hashes, memory_limit_mb)
+    except:
+        print(f"Could not open {file_path}, skipping...")
+        return None
+    num_pages = len(doc)
+    year, make, model, system = extract_info_from_filename(file_path)
+    classifier = classifier or default_classifier
+    guard = MemoryGuard(memory_limit_mb)
+    highlights = []
+    for page_num in range(num_pages):
+        if guard.window_end(page_num):
+            guard.check()  # Rows are small; what builds up is MuPDF's cache of the pages already read
+        page = doc[page_num]
+        with PROFILE.stage("scan", pages=1) as counts:
+            annotations = list(page.annots(types=[fitz.PDF_ANNOT_HIGHLIGHT]))
+            counts["annotations"] = len(annotations)
+        if not annotations:
+            continue  # Pages without highlights never have their text extracted
+        color_classifications = classifier.classify([annotation.colors["stroke"] for annotation in annotations])
+        # Text is read once per page and shared out between the page's highlights
+        with PROFILE.stage("text", pages=1):
+            highlight_words = words_in_rects(page.get_text("words"), [annotation.rect for annotation in annotations])
+        for words, color_classification in zip(highlight_words, color_classifications):
+            highlighted_text = PRINTABLE_FILTER.sub("", ' '.join(words))  # remove any non-printable characters
+            highlight = {
+                "Year": year,
+                "Make": make,
+                "Model": model,
+                "System": system,
+                "Text": highlighted_text,
+                "HighlightColor": color_classification,
+                "Page": page_num + 1  # Not a CSV column; used by the search index
+            }
+            highlights.append(highlight)
+    doc.close()
+    return highlights
+
+def extract_file_job(file_path, classifier=None, memory_limit_mb=None):
+    # extract_file_highlights for extract_library: (rows, content hash or None), the hash taken in the worker
+    hashes = {}
+    return extract_file_highlights(file_path, classifier, memory_limit_mb, hashes), hashes.get(file_path)
+
+OVERSIZE_KB = 1400  # Files above this are split into parts
+SPLIT_PART_KB = 1300  # Target ceiling for each part
+PART_OVERHEAD_BYTES = 2048  # Catalog, page tree, trailer and xref of a saved part
+PAGE_OVERHEAD_BYTES = 256  # Page tree entry and xref row per page
+
+def xref_size(doc, xref):
+    size = len(doc.xref_object(xref, compressed=True))
+    if doc.xref_is_stream(xref):
+        size += len(doc.xref_stream_raw(xref))
+    return size
+
+PAGE_TREE_KEYS = re.compile(r"/(Parent|P|Dest|B)\s*\d+ \d+ R")  # Back and cross links that insert_pdf doesn't copy along
+PAGE_TYPE = re.compile(r"/Type\s*/Pages?\b")
+
+def estimate_page_sizes(doc):
+    # One pass over the document: every object each page pulls into a part and the serialized size of each.
+    # References are followed all the way down (font -> descriptor -> FontFile, image -> SMask, form XObject ->
+    # its own resources), stopping at the page tree and other pages. Fonts and images shared between pages are
+    # only counted once per part when packing.
+    xref_sizes = {}
+    references = {}  # xref -> xrefs its object refers to
+    page_xrefs = []
+    for page in doc:
+        # Inherited resources are found through the page's own lists; the page tree itself is not followed
+        todo = [page.xref]
+        todo.extend(page.get_contents())
+        todo.extend(image[0] for image in page.get_images(full=True))
+        todo.extend(font[0] for font in page.get_fonts(full=True) if font[0] > 0)
+        todo.extend(xobject[0] for xobject in page.get_xobjects())
+        xrefs = set()
+        while todo:
+            xref = todo.pop()
+            if xref in xrefs or not 0 < xref < doc.xref_length():
+                continue
+            if xref not in references:
+                source = doc.xref_object(xref, compressed=True)
+                if xref != page.xref and PAGE_TYPE.search(source):
+                    references[xref] = None  # Another page or the page tree
+                else:
+                    references[xref] = [int(match) for match in OBJECT_REFERENCE.findall(PAGE_TREE_KEYS.sub("", source))]
+                    xref_sizes[xref] = xref_size(doc, xref)
+            if references[xref] is None:
+                continue
+            xrefs.add(xref)
+            todo.extend(references[xref])
+        page_xrefs.append(xrefs)
+    return page_xrefs, xref_sizes
+
+def plan_split_parts(page_xrefs, xref_sizes, max_part_kb=SPLIT_PART_KB):
+    # Packs consecutive pages into (first_page, last_page) ranges that stay under max_part_kb.
+    # A single page over the budget still gets a part of its own.
+    budget = max_part_kb * 1024
+    parts = []
+    first_page = 0
+    part_xrefs = set()
+    part_size = PART_OVERHEAD_BYTES
+    for page_num, xrefs in enumerate(page_xrefs):
+        added = PAGE_OVERHEAD_BYTES + sum(xref_sizes[xref] for xref in xrefs - part_xrefs)
+        if page_num > first_page and part_size + added > budget:
+            parts.append((first_page, page_num - 1))
+            first_page = page_num
+            part_xrefs = set()
+            part_size = PART_OVERHEAD_BYTES
+            added = PAGE_OVERHEAD_BYTES + sum(xref_sizes[xref] for xref in xrefs)
+        part_xrefs |= xrefs
+        part_size += added
+    if page_xrefs:
+        parts.append((first_page, len(page_xrefs) - 1))
+    return parts
+
+def verify_pdf(file_path, expected_pages):
+    # Reads a freshly written PDF back; raises if it doesn't open or lost pages
+    with PROFILE.stage("verify", pages=expected_pages):
+        with fitz.open(file_path) as check:
+            pages = len(check)
+    if pages != expected_pages:
+        raise ValueError(f"{file_path} has {pages} pages instead of {expected_pages}")
+
+def discard(file_path):
+    if os.path.exists(file_path):
+        os.remove(file_path)
+
+def replace_if_smaller(temp_path, input_path, expected_pages):
+    # The original is only ever replaced by a complete, verified and smaller file, and then with a single
+    # os.replace, so a crash at any point leaves either the old or the new file. Returns True if replaced.
+    try:
+        verify_pdf(temp_path, expected_pages)
+        if os.path.getsize(temp_path) >= os.path.getsize(input_path):
+            discard(temp_path)
+            return False
+        os.replace(temp_path, input_path)
+        return True
+    except Exception:
+        discard(temp_path)
+        raise
+
+PART_FILE_NAME = re.compile(r" part-\d+\.pdf$", re.IGNORECASE)  # Written by split_pdf_by_size
+
+def node_temp_path(path):
+    # "<path>.<host>-<pid>.tmp": two workers or machines that end up on the same file never share a temp file
+    return f"{path}.{socket.gethostname()}-{os.getpid()}.tmp"
+
+def split_pdf_by_size(input_path, output_folder, max_part_kb=SPLIT_PART_KB, guard=None):
+    # Writes "<name> part-N.pdf" files into output_folder. Parts are written as .tmp files, verified and checked
+    # against max_part_kb (a part the estimate got wrong is halved and written again), and only renamed into
+    # place once every part is good; the caller removes the original. Returns [] and writes nothing when the
+    # file would come out as a single part (one page over the budget), so it stays where it is.
+    guard = guard or MemoryGuard()
+    base_filename = os.path.splitext(os.path.basename(input_path))[0]
+    created_folder = not os.path.isdir(output_folder)
+    os.makedirs(output_folder, exist_ok=True)
+    doc = open_pdf(input_path)
+    part_paths = []
+    temp_paths = []
+    try:
+        # "split" is the size estimate and packing; writing the parts counts as insert_pdf and save
+        with PROFILE.stage("split", pages=len(doc)):
+            page_xrefs, xref_sizes = estimate_page_sizes(doc)
+            parts = plan_split_parts(page_xrefs, xref_sizes, max_part_kb)
+        if parts == [(0, 0)]:
+            parts = []
+        while parts:
+            first_page, last_page = parts.pop(0)
+            output_file = os.path.join(output_folder, f"{base_filename} part-{len(part_paths) + 1}.pdf")
+            temp_paths.append(node_temp_path(output_file))
+            part = fitz.open()
+            with PROFILE.stage("insert_pdf", pages=last_page - first_page + 1):
+                part.insert_pdf(doc, from_page=first_page, to_page=last_page)
+            save_pdf(part, temp_paths[-1], garbage=4, deflate=True, clean=True)
+            part.close()
+            verify_pdf(temp_paths[-1], last_page - first_page + 1)
+            guard.check()  # Parts are already page windows; this only lets go of the pages written so far
+            if os.path.getsize(temp_paths[-1]) / 1024 > max_part_kb:
+                if first_page < last_page:
+                    # The estimate came in low; the halves are written again under the same part number
+                    discard(temp_paths.pop())
+                    middle = (first_page + last_page) // 2
+                    parts[:0] = [(first_page, middle), (middle + 1, last_page)]
+                    continue
+                print(f"Page {first_page + 1} of {input_path} alone is larger than {max_part_kb} KB")
+            part_paths.append(output_file)
+        if len(part_paths) == 1:
+            discard(temp_paths.pop())  # Fits in one part after all; moving it into a folder would gain nothing
+            part_paths = []
+        for temp_path, part_path in zip(temp_paths, part_paths):
+            os.replace(temp_path, part_path)
+        if created_folder and not part_paths:
+            os.rmdir(output_folder)
+    except Exception:
+        for temp_path in temp_paths:
+            discard(temp_path)
+        if created_folder and not os.listdir(output_folder):
+            os.rmdir(output_folder)
+        raise
+    finally:
+        doc.close()
+    return part_paths
+
+COMPRESSION_PRESETS = {
+    "lossless": {"dpi": None, "jpeg_quality": None},  # Object cleanup and stream deflate only
+    "email": {"dpi": 150, "jpeg_quality": 60},
+    "archive": {"dpi": 300, "jpeg_quality": 85},
+}
+DEFAULT_PRESET = "lossless"
+
+def downsample_images(doc, dpi, jpeg_quality):
+    # Re-encodes raster images placed above the target DPI as smaller JPEGs; returns how many were replaced.
+    # Each image object is handled once no matter how many pages of doc place it. Bilevel scans (better served by
+    # CCITT/JBIG2) and images with transparency masks are left alone.
+    seen = set()
+    replaced = 0
+    for page in doc:
+        for image in page.get_images(full=True):
+            xref, smask, width, height, bpc = image[0], image[1], image[2], image[3], image[4]
+            if xref in seen:
+                continue
+            seen.add(xref)
+            if smask or bpc == 1:
+                continue
+            rects = [rect for rect in page.get_image_rects(xref) if rect.width > 0 and rect.height > 0]
+            if not rects:
+                continue
+            rect = max(rects, key=lambda r: r.width * r.height)  # The largest placement decides the resolution needed
+            effective_dpi = min(width / (rect.width / 72), height / (rect.height / 72))
+            if effective_dpi <= dpi:
+                continue
+            try:
+                pix = fitz.Pixmap(doc, xref)
+                if pix.alpha or pix.colorspace is None or pix.colorspace.n not in (1, 3):
+                    pix = fitz.Pixmap(fitz.csRGB, pix)
+                scale = dpi / effective_dpi
+                pix = fitz.Pixmap(pix, max(1, int(pix.width * scale)), max(1, int(pix.height * scale)), None)
+                data = pix.tobytes("jpg", jpg_quality=jpeg_quality)
+                if len(data) < len(doc.xref_stream_raw(xref)):
+                    page.replace_image(xref, stream=data)
+                    replaced += 1
+            except Exception as e:
+                print(f"Error while downsampling image {xref}: {str(e)}")
+    return replaced
+
+def copy_page_range(new_doc, doc, from_page, to_page, input_path):
+    # Copies a run of pages in one insert_pdf call; if that fails, the pages are retried one by one so a
+    # single broken page doesn't lose the rest of the run
+    start = len(new_doc)
+    try:
+        new_doc.insert_pdf(doc, from_page=from_page, to_page=to_page, rotate=0)
+        return
+    except Exception:
+        if len(new_doc) > start:
+            new_doc.delete_pages(from_page=start, to_page=len(new_doc) - 1)
+    for page_num in range(from_page, to_page + 1):
+        try:
+            new_doc.insert_pdf(doc, from_page=page_num, to_page=page_num, rotate=0)
+        except Exception as e:
+            print(f"Error while compressing page {page_num + 1} of {input_path}: {str(e)}")
+
+def compress_streaming(doc, temp_path, settings, result):
+    # Memory-limit fallback: no second document; the source is rewritten object by object into the temp file.
+    # garbage=3 rather than 4 because merging duplicate streams needs them all loaded to compare.
+    if settings["dpi"]:
+        with PROFILE.stage("images", pages=len(doc)):
+            result["images"] = downsample_images(doc, settings["dpi"], settings["jpeg_quality"])
+    save_pdf(doc, temp_path, garbage=3, deflate=True, deflate_images=True, deflate_fonts=True)
+    doc.close()
+
+def compress_pdf(input_path, max_part_kb=SPLIT_PART_KB, preset=DEFAULT_PRESET, memory_limit_mb=None):
+    # Returns {"path", "size_kb", "after_kb", "oversized", "split", "parts", "part_paths", "images", "streamed", "replaced", "error"} so
+    # reports can be built from worker results. Files are compressed first and only split if they are still over OVERSIZE_KB afterwards;
+    # one that can't be divided (a single page over the budget) stays where it is and is only reported as oversized. Parts written by
+    # an earlier run are compressed but never split again. The compressed copy is written to a temp file next to it and swapped in by replace_if_smaller.
+    settings = COMPRESSION_PRESETS[preset]
+    result = {"path": input_path, "size_kb": 0.0, "after_kb": 0.0, "oversized": False, "split": False, "parts": 0, "part_paths": [], "images": 0,
+              "streamed": False, "replaced": False, "error": ""}
+    guard = MemoryGuard(memory_limit_mb)
+    temp_path = node_temp_path(input_path)
+    try:
+        result["size_kb"] = os.path.getsize(input_path) / 1024  # Calculate file size in kilobytes
+        output_path = input_path  # Use the same input path as the output path
+        doc = open_pdf(input_path)  # Open the document for compression
+        page_count = len(doc)
+        new_doc = fitz.open()  # Open a new document for compressed content
+        # Each insert_pdf call gets its own copy of every image and font its pages use, so the whole document
+        # is copied in one call, or one call per page window when a memory limit is set
+        ranges = [(0, page_count - 1)] if page_count else []
+        if guard.limit_mb is not None:
+            ranges = window_ranges(ranges, guard.window)
+        with PROFILE.stage("insert_pdf", pages=len(doc)):
+            for from_page, to_page in ranges:
+                copy_page_range(new_doc, doc, from_page, to_page, input_path)
+                if guard.limit_mb is not None and guard.check():
+                    break
+        if guard.streaming:
+            new_doc.close()
+            print(f"{input_path} is over the {memory_limit_mb} MB memory limit, compressing it in streaming mode")
+            result["streamed"] = True
+            compress_streaming(doc, temp_path, settings, result)
+        else:
+            doc.close()  # Close the original document
+            if settings["dpi"]:
+                with PROFILE.stage("images", pages=len(new_doc)):
+                    result["images"] = downsample_images(new_doc, settings["dpi"], settings["jpeg_quality"])
+            # garbage=4 also merges byte-identical streams, so fonts and images repeated across pages are stored once
+            save_pdf(new_doc, temp_path, garbage=4, deflate=True, deflate_images=True, deflate_fonts=True, clean=True)
+            new_doc.close()  # Close the new document
+        # A page that failed to copy above makes the page count check fail, so the original is kept whole
+        result["replaced"] = replace_if_smaller(temp_path, output_path, page_count)
+        file_size_kb = os.path.getsize(output_path) / 1024
+        result["after_kb"] = file_size_kb
+        if file_size_kb > OVERSIZE_KB and not PART_FILE_NAME.search(os.path.basename(input_path)):
+            result["oversized"] = True
+            folder_name = os.path.splitext(os.path.basename(input_path))[0]
+            folder_path = os.path.join(os.path.dirname(input_path), folder_name)
+            part_paths = split_pdf_by_size(input_path, folder_path, max_part_kb, guard)
+            if part_paths:
+                result["split"] = True
+                result["parts"] = len(part_paths)
+                result["part_paths"] = part_paths
+                result["after_kb"] = sum(os.path.getsize(part_path) for part_path in part_paths) / 1024
+                os.remove(input_path)  # Only reached once every part has been verified and renamed into place
+            else:
+                result["parts"] = 1
+                print(f"{input_path} is a single page over {max_part_kb} KB and is left whole")
+    except Exception as e:
+        discard(temp_path)
+        result["error"] = str(e)
+        print(f"Error while compressing PDF: {str(e)}")
+    return result
+
+def copy_compressed_result(result, file_path):
+    # Gives a byte-identical copy the outcome compress_pdf produced for result["path"], by copying the
+    # compressed file or its parts instead of compressing the same bytes again
+    copied = dict(result, path=file_path, part_paths=[])
+    if result["split"]:
+        base_filename = os.path.splitext(os.path.basename(file_path))[0]
+        folder_path = os.path.join(os.path.dirname(file_path), base_filename)
+        os.makedirs(folder_path, exist_ok=True)
+        for part_num, part_path in enumerate(result["part_paths"], 1):
+            copied["part_paths"].append(os.path.join(folder_path, f"{base_filename} part-{part_num}.pdf"))
+            copy_file_atomic(part_path, copied["part_paths"][-1])
+        os.remove(file_path)
+    elif result["replaced"]:
+        copy_file_atomic(result["path"], file_path)
+    return copied
+
+OVERSIZED_FIELDS = ["Year", "Make", "Model", "System", "File size", "Parts"]
+NO_OVERSIZED_TEXT = "NO OVERSIZED PDF FILES"
+
+def oversized_row(result, entry):
+    # Year/Make/Model from the file's ManifestEntry; "N/A" for a PDF above the Model level
+    return {"Year": entry.year or "N/A", "Make": entry.make or "N/A", "Model": entry.model or "N/A", "System": "N/A", "File size": f"{result['size_kb']:.2f} KB", "Parts": result["parts"]}
+
+def write_oversized_report(compress_results, output_dir, entries):
+    # entries[i] is the ManifestEntry of the file compress_results[i] belongs to
+    oversized_files = [oversized_row(result, entry) for result, entry in zip(compress_results, entries) if result and result.get("oversized", result["split"])]
+    csv_report_path = os.path.join(output_dir, "oversized_files_report.csv")
+    with open(csv_report_path, 'w', newline='', encoding='utf-8') as csv_file:
+        if not oversized_files:
+            csv_file.write(NO_OVERSIZED_TEXT)
+            print("No oversized PDF files found.")
+        else:
+            writer = csv.DictWriter(csv_file, fieldnames=OVERSIZED_FIELDS)
+            writer.writeheader()
+            writer.writerows(oversized_files)
+            print(f"Oversized PDF files report written to: {csv_report_path}")
+    return csv_report_path
+
+def append_oversized_report(result, output_dir, entry):
+    # Adds one oversized file to an existing report (watch mode), replacing the "none found" placeholder
+    csv_report_path = os.path.join(output_dir, "oversized_files_report.csv")
+    try:
+        with open(csv_report_path, encoding="utf-8") as csv_file:
+            has_rows = csv_file.read(len(NO_OVERSIZED_TEXT)) not in ("", NO_OVERSIZED_TEXT)
+    except OSError:
+        has_rows = False
+    with open(csv_report_path, "a" if has_rows else "w", newline="", encoding="utf-8") as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=OVERSIZED_FIELDS)
+        if not has_rows:
+            writer.writeheader()
+        writer.writerow(oversized_row(result, entry))
+    return csv_report_path
+
+# Scheduling: each job's cost is estimated in seconds on a typical workstation from what is known before it runs
+# (size, page count, highlight count), measured on generated documents. With several workers the most expensive
+# files are dispatched first, longest processing time first, so a 2,000-page manual is not the last file started
+# and left running alone at the end of the run. Progress and the ETA are reported in the same units.
+COST_WEIGHTS = {
+    "compress": {"file": 0.005, "page": 0.001, "mb": 0.006, "annotation": 0.0},
+    "compress-images": {"file": 0.005, "page": 0.001, "mb": 0.1, "annotation": 0.0},  # Presets that downsample images
+    "extract": {"file": 0.003, "page": 0.0004, "mb": 0.0, "annotation": 0.0002},
+    "copy": {"file": 0.003, "page": 0.0004, "mb": 0.0, "annotation": 0.0008},
+}
+BYTES_PER_PAGE_GUESS = 30 * 1024  # For files whose page count is unknown
+SCHEDULE_WINDOW = 50  # Jobs reordered together when their results are written out in library order
+
+def estimate_cost(kind, size, pages=None, annotations=None):
+    weights = COST_WEIGHTS[kind]
+    if pages is None:
+        pages = max(1, size // BYTES_PER_PAGE_GUESS)
+    return weights["file"] + weights["page"] * pages + weights["mb"] * size / (1024 * 1024) + weights["annotation"] * (annotations or 0)
+
+def page_count(file_path):
+    # From the xref and the page tree root; no page is loaded
+    with PROFILE.stage("estimate") as counts:
+        doc = fitz.open(file_path)
+        try:
+            counts["pages"] = doc.page_count
+        finally:
+            doc.close()
+    return counts["pages"]
+
+def schedule_jobs(costs, workers=1, window=None):
+    # Job positions in dispatch order: most expensive first across several workers (the pool hands jobs out in
+    # submission order). A single worker keeps library order, which its read-ahead and the streamed CSV follow.
+    # With a window, jobs are only reordered within consecutive runs of that many, so output kept in library
+    # order never waits on a file from far down the list.
+    positions = list(range(len(costs)))
+    if workers > 1:
+        window = window or len(positions) or 1
+        positions = [position for start in range(0, len(positions), window)
+                     for position in sorted(positions[start:start + window], key=lambda position: costs[position], reverse=True)]
+    return positions
+
+def cost_fraction(done_cost, total_cost):
+    return done_cost / total_cost if total_cost else 1.0
+
+def default_workers():
+    return max(1, (os.cpu_count() or 1) - 1)
+
+def iter_pipelined(func, jobs, cancelled=None, memory_limit_mb=None):
+    # The one-worker path for jobs whose job[0] is a PDF to open: upcoming files are read on a prefetch thread
+    # and highlight copies written on a writer thread while this thread parses (see si_pipeline). A job is
+    # yielded, in job order, once the files it wrote are on disk.
+    PIPELINE.prefetcher = Prefetcher([job[0] for job in jobs], max_mb=prefetch_budget_mb(memory_limit_mb))
+    PIPELINE.writer = BackgroundWriter()
+    waiting = []  # (index, result, error) whose writes may still be queued
+    try:
+        for index, job in enumerate(jobs):
+            if cancelled is not None and cancelled():
+                break
+            PIPELINE.writer.tag = index
+            try:
+                result, stats = profiled_call(func, *job)
+            except Exception as e:
+                waiting.append((index, None, str(e)))
+            else:
+                PROFILE.add_file(job[0], stats)
+                waiting.append((index, result, None))
+            PIPELINE.prefetcher.release(job[0])
+            while waiting and PIPELINE.writer.finished(waiting[0][0])[0]:
+                index, result, error = waiting.pop(0)
+                write_error = PIPELINE.writer.finished(index)[1]
+                yield (index, None, write_error) if write_error else (index, result, error)
+    finally:
+        PIPELINE.prefetcher.close()
+        PIPELINE.writer.close()  # Waits for every queued write
+        writer = PIPELINE.writer
+        PIPELINE.prefetcher = PIPELINE.writer = None
+    for index, result, error in waiting:
+        write_error = writer.finished(index)[1]
+        yield (index, None, write_error) if write_error else (index, result, error)
+
+def iter_parallel(func, jobs, workers=1, cancelled=None, pipeline=False, memory_limit_mb=None, record_files=True):
+    # Yields (index, result, error) as jobs finish; each job is an argument tuple for func.
+    # A worker that dies outright breaks the pool and fails every unfinished job with it. Workers take jobs in
+    # submission order, so only the first `workers` unfinished ones were running: those are run again in a
+    # pool each, where a crash can only be their own, and the rest go back into a fresh shared pool.
+    # cancelled() is polled between jobs; queued jobs are dropped and running ones allowed to finish.
+    # Every job runs through profiled_call and its stage timings are added to PROFILE under job[0]; helper
+    # passes (record_files=False) only add to the stage totals, so their files are not counted twice.
+    # pipeline=True overlaps reads and writes with parsing when there is a single worker; with several,
+    # the worker processes already keep the disk and the CPUs busy at the same time. Under memory_limit_mb the
+    # read-ahead buffers only get a share of the limit (see prefetch_budget_mb).
+    jobs = list(jobs)
+
+    def record(file_path, stats):
+        if record_files:
+            PROFILE.add_file(file_path, stats)
+        else:
+            PROFILE.add_stages(stats)
+
+    if workers <= 1 and pipeline:
+        yield from iter_pipelined(func, jobs, cancelled, memory_limit_mb)
+        return
+    if workers <= 1:
+        for index, job in enumerate(jobs):
+            if cancelled is not None and cancelled():
+                return
+            try:
+                result, stats = profiled_call(func, *job)
+            except Exception as e:
+                yield index, None, str(e)
+            else:
+                record(job[0], stats)
+                yield index, result, None
+        return
+    pending = list(range(len(jobs)))
+    suspects = []
+    while pending or suspects:
+        broken = []
+        pools = [[index] for index in suspects] if suspects else [pending]
+        executors = [ProcessPoolExecutor(max_workers=min(workers, len(indices))) for indices in pools]
+        try:
+            futures = {executor.submit(profiled_call, func, *jobs[index]): index for executor, indices in zip(executors, pools) for index in indices}
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    result, stats = future.result()
+                except BrokenProcessPool:
+                    if suspects:
+                        yield index, None, "Worker process crashed"
+                    else:
+                        broken.append(index)
+                except Exception as e:
+                    yield index, None, str(e)
+                else:
+                    record(jobs[index][0], stats)
+                    yield index, result, None
+                if cancelled is not None and cancelled():
+                    return
+        finally:
+            for executor in executors:
+                executor.shutdown(wait=True, cancel_futures=True)
+        if suspects:
+            suspects = []
+        else:
+            broken.sort()
+            suspects, pending = broken[:workers], broken[workers:]
+
+# Library-wide operations shared by the GUI job runner and the si_cli.py command line.
+# progress(done, total, file_path, fraction) and on_error(file_path, message) are optional callbacks;
+# done/total count files and fraction is the share of the estimated cost done (see COST_WEIGHTS).
+# cancelled() is polled between files, and memory_limit_mb caps each worker's resident memory
+# (see MemoryGuard). Each returns one report record per PDF.
+
+def file_record(file_path, status, error=""):
+    return {"File": file_path, "Status": status, "Error": error}
+
+def compress_record(file_path, result, status=None):
+    status = status or ("split" if result["split"] else "oversized" if result.get("oversized") else "compressed" if result["replaced"] else "unchanged")
+    return dict(file_record(file_path, status),
+                **{"Before KB": f"{result['size_kb']:.2f}", "After KB": f"{result['after_kb']:.2f}", "Parts": result["parts"], "Images": result["images"], "Streamed": result["streamed"]})
+
+def timed_crawl(input_path, manifest=None):
+    # A manifest handed in by the caller (GUI, benchmark) was crawled already and costs nothing here
+    with PROFILE.stage("crawl"):
+        if manifest is None:
+            manifest = crawl_library(input_path)
+    return manifest
+
+def compress_library(parent_directory_path, output_dir, workers=1, progress=None, cancelled=None, on_error=None, max_part_kb=SPLIT_PART_KB, preset=DEFAULT_PRESET, manifest=None, memory_limit_mb=None):
+    PROFILE.start_operation("compress")
+    manifest = timed_crawl(parent_directory_path, manifest)
+    pdf_paths = [entry.path for entry in manifest]
+    total_files = len(pdf_paths)
+    compress_results = [None] * total_files
+    records = [file_record(path, "not run") for path in pdf_paths]
+    processed_files = 0
+    # Byte-identical copies are compressed once; the others get the result copied over
+    groups = content_groups(manifest)
+    primaries = [group[0] for group in groups]
+    duplicates = {group[0]: group[1:] for group in groups if len(group) > 1}
+    print(f"{total_files - len(primaries)} files are copies of another file and will not be compressed separately")
+
+    def record_result(index, result, error, status=None):
+        nonlocal processed_files
+        if error:
+            records[index] = file_record(pdf_paths[index], "failed", error)
+            if on_error:
+                on_error(pdf_paths[index], error)
+        else:
+            records[index] = compress_record(pdf_paths[index], result, status)
+            print(f"{os.path.basename(pdf_paths[index])}: {result['size_kb']:.2f} KB -> {result['after_kb']:.2f} KB")
+        compress_results[index] = result
+        processed_files += 1
+        print(f"Compressing: {os.path.basename(pdf_paths[index])}. Total Progress: {int(cost_fraction(done_cost, total_cost) * 100)}%")
+        if progress:
+            progress(processed_files, total_files, pdf_paths[index], cost_fraction(done_cost, total_cost))
+
+    # Costs from size and the page count in each file's xref; files that can't be opened are estimated from size.
+    # One worker runs the files in library order anyway, so only the progress estimate would gain from opening
+    # every file an extra time; it goes by size alone.
+    kind = "compress-images" if COMPRESSION_PRESETS[preset]["dpi"] else "compress"
+    costs = {index: estimate_cost(kind, manifest[index].size) for index in primaries}
+    page_jobs = [(pdf_paths[index],) for index in primaries] if workers > 1 else []
+    for job_index, pages, error in iter_parallel(page_count, page_jobs, workers, cancelled, record_files=False):
+        if not error:
+            costs[primaries[job_index]] = estimate_cost(kind, manifest[primaries[job_index]].size, pages)
+    primaries = [primaries[position] for position in schedule_jobs([costs[index] for index in primaries], workers)]
+    total_cost = sum(costs.values())
+    done_cost = 0.0
+    for job_index, result, error in iter_parallel(compress_pdf, [(pdf_paths[index], max_part_kb, preset, memory_limit_mb) for index in primaries], workers, cancelled, True, memory_limit_mb):
+        index = primaries[job_index]
+        done_cost += costs[index]
+        error = error or (result and result["error"])
+        record_result(index, result, error)
+        for duplicate in duplicates.get(index, []):
+            if error:
+                record_result(duplicate, None, f"Same content as {pdf_paths[index]}, which failed: {error}")
+                continue
+            try:
+                record_result(duplicate, copy_compressed_result(result, pdf_paths[duplicate]), "", "duplicate")
+            except Exception as e:
+                record_result(duplicate, None, str(e))
+    # compress_pdf already moved and split anything oversized that could be split; only the report is left
+    write_oversized_report(compress_results, output_dir, manifest)
+    write_run_summary(output_dir)
+    print(f'Compression and file moving/splitting complete.')
+    return records
+
+HIGHLIGHT_FIELDS = ["Year", "Make", "Model", "System", "Text", "HighlightColor"]
+
+class HighlightCsvWriter:
+    # Streams "Extracted Highlights.csv" file by file. After every flush_every files the CSV is flushed and
+    # "<csv>.resume" records how many files (in walk order) are complete and the byte offset they end at,
+    # so an interrupted run truncates any partial batch and carries on from there. before_checkpoint() is
+    # called first, so anything kept alongside the CSV (the search index) is never behind the marker.
+    def __init__(self, csv_path, input_path, file_paths, flush_every=50, before_checkpoint=None):
+        self.csv_path = csv_path
+        self.before_checkpoint = before_checkpoint
+        self.marker_path = csv_path + ".resume"
+        self.input_path = input_path
+        self.flush_every = flush_every
+        self.done = 0
+        self.rows = 0
+        self.unflushed = 0
+        self.last_file = ""
+        marker = self.read_marker()
+        if (marker and marker["input"] == input_path and os.path.exists(csv_path)
+                and 0 < marker["done"] <= len(file_paths) and file_paths[marker["done"] - 1] == marker["last_file"]
+                and os.path.getsize(csv_path) >= marker["offset"]):
+            with open(csv_path, "rb+") as csv_file:
+                csv_file.truncate(marker["offset"])
+            self.done, self.rows, self.last_file = marker["done"], marker["rows"], marker["last_file"]
+            self.csv_file = open(csv_path, "a", newline="", encoding="utf-8")
+            self.writer = csv.DictWriter(self.csv_file, fieldnames=HIGHLIGHT_FIELDS, extrasaction="ignore")
+            print(f"Resuming {csv_path} after {self.done} files")
+        else:
+            self.csv_file = open(csv_path, "w", newline="", encoding="utf-8")
+            self.writer = csv.DictWriter(self.csv_file, fieldnames=HIGHLIGHT_FIELDS, extrasaction="ignore")
+            self.writer.writeheader()
+
+    def read_marker(self):
+        try:
+            with open(self.marker_path, encoding="utf-8") as marker_file:
+                return json.load(marker_file)
+        except (OSError, ValueError):
+            return None
+
+    def write_file_rows(self, file_path, rows):
+        self.writer.writerows(rows)
+        self.rows += len(rows)
+        self.done += 1
+        self.last_file = file_path
+        self.unflushed += 1
+        if self.unflushed >= self.flush_every:
+            self.checkpoint()
+
+    def checkpoint(self):
+        if self.before_checkpoint:
+            self.before_checkpoint()
+        self.csv_file.flush()
+        os.fsync(self.csv_file.fileno())
+        marker = {"input": self.input_path, "done": self.done, "rows": self.rows, "offset": self.csv_file.tell(), "last_file": self.last_file}
+        with open(self.marker_path + ".tmp", "w", encoding="utf-8") as marker_file:
+            json.dump(marker, marker_file)
+        os.replace(self.marker_path + ".tmp", self.marker_path)
+        self.unflushed = 0
+
+    def close(self):
+        # Interrupted run: keep the marker so the next run resumes
+        if self.done:
+            self.checkpoint()
+        self.csv_file.close()
+
+    def finish(self):
+        self.csv_file.close()
+        if os.path.exists(self.marker_path):
+            os.remove(self.marker_path)
+        if self.rows == 0:
+            os.remove(self.csv_path)
+
+def extract_library(parent_directory_path, output_csv_path, workers=1, progress=None, cancelled=None, on_error=None, classifier=None, manifest=None, memory_limit_mb=None):
+    PROFILE.start_operation("extract-highlights")
+    manifest = timed_crawl(parent_directory_path, manifest)
+    entries = library_entries(manifest)
+    file_paths = [entry.path for entry in entries]
+    total_files = len(file_paths)
+    make_ends = {}  # index just past each make's last file -> make
+    for index, entry in enumerate(entries):
+        if index + 1 == total_files or entries[index + 1].make != entry.make:
+            make_ends[index + 1] = entry.make
+    records = [file_record(path, "not run") for path in file_paths]
+    # Every file's rows also go into the search index next to the CSV (see si_search)
+    search_index = HighlightIndex.for_output(os.path.dirname(output_csv_path))
+    csv_writer = HighlightCsvWriter(output_csv_path, parent_directory_path, file_paths, before_checkpoint=search_index.commit)
+    for index in range(csv_writer.done):
+        records[index] = file_record(file_paths[index], "resumed")
+    processed_files = csv_writer.done
+    # Rows are written in walk order as soon as every earlier file is done, so the CSV is stable
+    # while only out-of-order results wait in memory
+    ready = {}
+    next_index = csv_writer.done
+    cached_indexes = set()
+    unopened = set()  # Files that could not be opened: a placeholder row in the CSV, nothing in the index
+
+    def write_ready():
+        nonlocal next_index
+        while next_index in ready:
+            rows = ready.pop(next_index) or []
+            # Cached rows are what an earlier run indexed, so only files the index is missing (a new or deleted index) are re-indexed
+            if next_index in unopened:
+                search_index.replace_file(file_paths[next_index], [])
+            elif next_index not in cached_indexes or search_index.has_file(file_paths[next_index]) != bool(rows):
+                search_index.replace_file(file_paths[next_index], rows)
+            csv_writer.write_file_rows(file_paths[next_index], rows)
+            next_index += 1
+            if next_index in make_ends:
+                print(f"Finished Processing: {make_ends[next_index]}")
+
+    # Unchanged files reuse the rows cached by an earlier run; only the rest are parsed
+    classifier = classifier or default_classifier
+    cache = ScanCache.for_output(os.path.dirname(output_csv_path), classifier.signature())
+    completed = False
+    try:
+        stale = []
+        for index in range(csv_writer.done, total_files):
+            cached = cache.lookup(file_paths[index], entries[index].size, entries[index].mtime)
+            if cached and cached["highlights"] is not None:
+                ready[index] = cached["highlights"]
+                cached_indexes.add(index)
+                records[index] = file_record(file_paths[index], "cached")
+                processed_files += 1
+            else:
+                stale.append(index)
+        print(f"Reusing cached highlights for {processed_files - csv_writer.done} of {total_files - csv_writer.done} files")
+        # Byte-identical copies are parsed once and get the first copy's rows under their own name
+        groups = content_groups([entries[index] for index in stale])
+        duplicates = {stale[group[0]]: [stale[position] for position in group[1:]] for group in groups if len(group) > 1}
+        stale = [stale[group[0]] for group in groups]
+
+        def add_duplicates(index, highlights, error="", content_hash=None):
+            nonlocal processed_files
+            for duplicate in duplicates.get(index, []):
+                if error:
+                    records[duplicate] = file_record(file_paths[duplicate], "failed", f"Same content as {file_paths[index]}, which failed: {error}")
+                    ready[duplicate] = None
+                else:
+                    ready[duplicate] = relabel_highlights(highlights, file_paths[index], file_paths[duplicate])
+                    records[duplicate] = dict(file_record(file_paths[duplicate], "duplicate"), **{"Duplicate of": file_paths[index]})
+                    cache.store(file_paths[duplicate], highlights=ready[duplicate], content_hash=content_hash)
+                processed_files += 1
+
+        # Files without a single Highlight annotation are never opened for the page loop
+        file_counts = {}
+        skipped = triage_files([file_paths[index] for index in stale], workers, cancelled, file_counts)
+        costs = {index: estimate_cost("extract", entries[index].size, **file_counts.get(job_index, {})) for job_index, index in enumerate(stale)}
+        for job_index in sorted(skipped):
+            index = stale[job_index]
+            ready[index] = []
+            records[index] = file_record(file_paths[index], "no highlights")
+            cache.store(file_paths[index], page_colors={}, highlights=[])
+            processed_files += 1
+            add_duplicates(index, [])
+        stale = [index for job_index, index in enumerate(stale) if job_index not in skipped]
+        stale = [stale[position] for position in schedule_jobs([costs[index] for index in stale], workers, SCHEDULE_WINDOW)]
+        total_cost = sum(costs[index] for index in stale)
+        done_cost = 0.0
+        print(f"{sum(len(copies) for copies in duplicates.values())} files are copies of another file and will not be parsed separately")
+        print(f"Skipped {len(skipped)} files with no highlight annotations")
+        write_ready()
+        if progress:
+            progress(processed_files, total_files, "", cost_fraction(done_cost, total_cost))
+        # Workers return each file's content hash with its rows, so the cache never reads a file a second time
+        for job_index, result, error in iter_parallel(extract_file_job, [(file_paths[index], classifier, memory_limit_mb) for index in stale], workers, cancelled, True, memory_limit_mb):
+            index = stale[job_index]
+            highlights, content_hash = result or (None, None)
+            if not error and highlights is None:
+                error = "Could not open file."
+                unopened.add(index)
+            if error:
+                print(f"Error while extracting highlights from {file_paths[index]}: {error}")
+                records[index] = file_record(file_paths[index], "failed", error)
+                if on_error:
+                    on_error(file_paths[index], error)
+            else:
+                cache.store(file_paths[index], highlights=highlights, content_hash=content_hash)
+                records[index] = file_record(file_paths[index], "extracted")
+            ready[index] = [OPEN_FAILED_ROW] if index in unopened else highlights
+            add_duplicates(index, highlights, error, content_hash)
+            write_ready()
+            processed_files += 1
+            done_cost += costs[index]
+            if progress:
+                progress(processed_files, total_files, file_paths[index], cost_fraction(done_cost, total_cost))
+        completed = next_index == total_files
+        if completed:
+            removed = search_index.prune(parent_directory_path, file_paths)
+            if removed:
+                print(f"Removed {removed} files that are no longer in the library from the search index")
+    finally:
+        cache.close()
+        if completed:
+            csv_writer.finish()
+        else:
+            csv_writer.close()
+        search_index.close()
+    print(f"Total highlights found: {csv_writer.rows}")
+    if completed and csv_writer.rows > 0:
+        print(f"Highlights saved to {output_csv_path}")
+    write_run_summary(os.path.dirname(output_csv_path))
+    return records
+
+def copy_library(input_path, output_path, modes=COPY_MODES, workers=1, highlight_index=None, progress=None, cancelled=None, on_error=None, classifier=None, manifest=None, memory_limit_mb=None):
+    # One pass over the library; pages already scanned this session are reused from highlight_index
+    # and pages from earlier runs come from the on-disk cache; files whose copies are already current are skipped.
+    # highlight_index maps file_path -> (size, mtime, page_colors); an entry whose size or mtime no longer matches
+    # the crawl is dropped, so a PDF edited between two runs is scanned again.
+    if highlight_index is None:
+        highlight_index = {}
+    PROFILE.start_operation("copy")
+    manifest = timed_crawl(input_path, manifest)
+    entries = library_entries(manifest)
+    file_paths = [entry.path for entry in entries]
+    entries_by_path = {entry.path: entry for entry in entries}
+    for file_path in list(highlight_index):
+        entry = entries_by_path.get(file_path)
+        if entry is None or highlight_index[file_path][:2] != (entry.size, entry.mtime):
+            del highlight_index[file_path]
+
+    def remember(file_path, page_colors):
+        highlight_index[file_path] = (entries_by_path[file_path].size, entries_by_path[file_path].mtime, page_colors)
+
+    records = {}
+    classifier = classifier or default_classifier
+    cache = ScanCache.for_output(output_path, classifier.signature())
+    jobs = []
+    job_paths = []
+    job_entries = []
+    processed_files = 0
+    for entry in entries:
+        file_path = entry.path
+        page_colors = highlight_index[file_path][2] if file_path in highlight_index else None
+        if page_colors is None:
+            cached = cache.lookup(file_path, entry.size, entry.mtime)
+            page_colors = cached["page_colors"] if cached else None
+        if page_colors is not None and highlight_outputs_current(file_path, output_path, modes, page_colors, entry.mtime):
+            remember(file_path, page_colors)
+            records[file_path] = file_record(file_path, "cached")
+            processed_files += 1
+            continue
+        jobs.append((file_path, output_path, modes, page_colors, classifier, memory_limit_mb))
+        job_paths.append(file_path)
+        job_entries.append(entry)
+    # Byte-identical copies are scanned and copied once; the others get the output files copied under their own name
+    groups = content_groups(job_entries)
+    duplicates = {job_paths[group[0]]: [job_paths[position] for position in group[1:]] for group in groups if len(group) > 1}
+    jobs = [jobs[group[0]] for group in groups]
+    job_paths = [job_paths[group[0]] for group in groups]
+    job_entries = [job_entries[group[0]] for group in groups]
+    print(f"{sum(len(copies) for copies in duplicates.values())} files are copies of another file and will not be scanned separately")
+
+    def add_duplicates(file_path, page_colors, error="", scanned=True, content_hash=None):
+        nonlocal processed_files
+        for duplicate in duplicates.get(file_path, []):
+            if error:
+                records[duplicate] = file_record(duplicate, "failed", f"Same content as {file_path}, which failed: {error}")
+            else:
+                try:
+                    for mode in collect_highlight_pages(page_colors, modes):
+                        source_output = highlight_output_path(file_path, output_path, mode)
+                        if highlight_output_path(duplicate, output_path, mode) != source_output:  # Same file name in another folder
+                            copy_file_atomic(source_output, highlight_output_path(duplicate, output_path, mode))
+                except OSError as e:
+                    records[duplicate] = file_record(duplicate, "failed", str(e))
+                    if on_error:
+                        on_error(duplicate, str(e))
+                else:
+                    remember(duplicate, page_colors)
+                    if scanned:
+                        cache.store(duplicate, page_colors=page_colors, content_hash=content_hash)
+                    records[duplicate] = dict(file_record(duplicate, "duplicate"), **{"Duplicate of": file_path})
+            processed_files += 1
+
+    # Only files never scanned need triage; known page colors already say whether there is anything to copy
+    unscanned = [index for index, job in enumerate(jobs) if job[3] is None]
+    file_counts = {}
+    skipped = {unscanned[index] for index in triage_files([job_paths[index] for index in unscanned], workers, cancelled, file_counts)}
+    # Scanned files are costed by their highlighted pages, the rest by the triage counts
+    costs = [estimate_cost("copy", entry.size, None, len(job[3])) if job[3] is not None else estimate_cost("copy", entry.size) for job, entry in zip(jobs, job_entries)]
+    for position, counts in file_counts.items():
+        costs[unscanned[position]] = estimate_cost("copy", job_entries[unscanned[position]].size, **counts)
+    for index in sorted(skipped):
+        remember(job_paths[index], {})
+        cache.store(job_paths[index], page_colors={}, highlights=[])
+        records[job_paths[index]] = file_record(job_paths[index], "no highlights")
+        processed_files += 1
+        add_duplicates(job_paths[index], {})
+    order = [position for position in schedule_jobs(costs, workers) if position not in skipped]
+    jobs = [jobs[position] for position in order]
+    job_paths = [job_paths[position] for position in order]
+    costs = [costs[position] for position in order]
+    total_cost = sum(costs)
+    done_cost = 0.0
+    print(f"Skipped {len(skipped)} files with no highlight annotations")
+    if progress:
+        progress(processed_files, len(file_paths), "", cost_fraction(done_cost, total_cost))
+    for index, result, error in iter_parallel(copy_file_job, jobs, workers, cancelled, True, memory_limit_mb):
+        # Only colors scanned in this run go to the on-disk cache; ones handed in came from it or from highlight_index
+        scanned = jobs[index][3] is None
+        page_colors, content_hash = result or (None, None)
+        if error:
+            records[job_paths[index]] = file_record(job_paths[index], "failed", error)
+            if on_error:
+                on_error(job_paths[index], error)
+        elif page_colors is None:
+            error = "Could not open file."
+            records[job_paths[index]] = file_record(job_paths[index], "failed", error)
+            if on_error:
+                on_error(job_paths[index], error)
+        else:
+            remember(job_paths[index], page_colors)
+            if scanned:
+                cache.store(job_paths[index], page_colors=page_colors, content_hash=content_hash)
+            records[job_paths[index]] = file_record(job_paths[index], "copied")
+        add_duplicates(job_paths[index], page_colors, error, scanned, content_hash)
+        processed_files += 1
+        done_cost += costs[index]
+        if progress:
+            progress(processed_files, len(file_paths), job_paths[index], cost_fraction(done_cost, total_cost))
+    cache.close()
+    write_run_summary(output_path)
+    return [records.get(file_path, file_record(file_path, "not run")) for file_path in file_paths]
+
+def write_run_report(records, report_path):
+    # JSON when the path ends in .json, CSV otherwise
+    if report_path.lower().endswith(".json"):
+        with open(report_path, "w", encoding="utf-8") as report_file:
+            json.dump(records, report_file, indent=2)
+        return report_path
+    fieldnames = []
+    for record in records:
+        fieldnames.extend(key for key in record if key not in fieldnames)
+    with open(report_path, "w", newline="", encoding="utf-8") as report_file:
+        writer = csv.DictWriter(report_file, fieldnames=fieldnames or ["File", "Status", "Error"])
+        writer.writeheader()
+        writer.writerows(records)
+    return report_path
@@ -0,0 +1,130 @@
+import os
+import queue
+import threading
+
+# Disk/CPU overlap for a single worker. PyMuPDF is not thread-safe, so all fitz work stays on the calling
+# thread; only plain file I/O moves to background threads:
+#   Prefetcher        reads the files of upcoming jobs into memory (open_pdf opens them with fitz.open(stream=...))
+#   BackgroundWriter  writes finished output bytes to disk while the next file is parsed
+# Both are bounded, so a slow share or a slow parse only ever has a few files in flight.
+
+PREFETCH_FILES = 4  # Files read ahead of the one being parsed
+PREFETCH_MB = 256  # Memory held by read-ahead buffers; bigger files are opened from disk as usual
+PREFETCH_SHARE = 0.25  # Of a memory limit, when one is set: the buffers count towards the worker's resident memory
+WRITE_QUEUE = 8  # Output files waiting for the writer before save_pdf blocks
+
+def prefetch_budget_mb(memory_limit_mb=None):
+    if memory_limit_mb is None:
+        return PREFETCH_MB
+    return min(PREFETCH_MB, memory_limit_mb * PREFETCH_SHARE)
+
+class Prefetcher:
+    def __init__(self, paths, max_files=PREFETCH_FILES, max_mb=PREFETCH_MB):
+        self.paths = list(paths)
+        self.positions = {path: position for position, path in enumerate(self.paths)}
+        self.max_files = max_files
+        self.max_bytes = max_mb * 1024 * 1024
+        self.buffers = {}  # path -> bytes, or None when too large or unreadable
+        self.held = 0
+        self.read_count = 0  # Files the reader has finished with, in order
+        self.stopped = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        for path in self.paths:
+            with self.condition:
+                while not self.stopped and (len(self.buffers) >= self.max_files or self.held >= self.max_bytes):
+                    self.condition.wait()
+                if self.stopped:
+                    return
+            data = None
+            try:
+                if os.path.getsize(path) <= self.max_bytes:
+                    with open(path, "rb") as pdf_file:
+                        data = pdf_file.read()
+            except OSError:
+                pass  # The job opens the file itself and reports the error
+            with self.condition:
+                self.buffers[path] = data
+                self.held += len(data) if data else 0
+                self.read_count += 1
+                self.condition.notify_all()
+
+    def take(self, path):
+        # The file's bytes, waiting for the reader if it hasn't got there yet. None (not prefetched, too large,
+        # or already taken by an earlier open) means the caller reads the file from disk.
+        position = self.positions.get(path)
+        if position is None:
+            return None
+        with self.condition:
+            while self.read_count <= position and not self.stopped:
+                self.condition.wait()
+            return self.release(path)
+
+    def release(self, path):
+        # Drops a buffer nobody took (the job failed or never opened the file) so the reader can move on
+        with self.condition:
+            data = self.buffers.pop(path, None)
+            self.held -= len(data) if data else 0
+            self.condition.notify_all()
+        return data
+
+    def close(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        self.thread.join()
+
+class BackgroundWriter:
+    # Writes are tagged with the job that produced them, so a job is only reported done once its files are on disk
+    def __init__(self, max_queued=WRITE_QUEUE):
+        self.queue = queue.Queue(max_queued)
+        self.lock = threading.Lock()
+        self.pending = {}  # tag -> writes not finished yet
+        self.errors = {}  # tag -> first error
+        self.tag = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def write(self, path, data):
+        with self.lock:
+            self.pending[self.tag] = self.pending.get(self.tag, 0) + 1
+        self.queue.put((self.tag, path, data))  # Blocks while the writer is WRITE_QUEUE files behind
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            tag, path, data = item
+            try:
+                with open(path + ".tmp", "wb") as output_file:
+                    output_file.write(data)
+                os.replace(path + ".tmp", path)
+            except OSError as e:
+                with self.lock:
+                    self.errors.setdefault(tag, f"Error while writing {path}: {str(e)}")
+            with self.lock:
+                self.pending[tag] -= 1
+
+    def finished(self, tag):
+        # (done, error) for every write of one job
+        with self.lock:
+            return self.pending.get(tag, 0) == 0, self.errors.get(tag)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+class PipelineState:
+    # What open_pdf and save_pdf use in this process; both None outside iter_pipelined
+    def __init__(self):
+        self.prefetcher = None
+        self.writer = None
+
+    def prefetched(self, path):
+        return self.prefetcher.take(path) if self.prefetcher is not None else None
+
+PIPELINE = PipelineState()
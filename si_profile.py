@@ -0,0 +1,118 @@
+import os
+import json
+import time
+from contextlib import contextmanager
+
+# Per-stage timings for the library operations. Each process has its own PROFILE; iter_parallel runs every
+# job through profiled_call so the stages a worker recorded for one file travel back with its result.
+#   with PROFILE.stage("open", bytes_read=size) as counts:
+#       doc = fitz.open(path)
+#       counts["pages"] = len(doc)
+# Stages: crawl, dedup, triage, estimate, open, scan, text, insert_pdf, images, save, verify, split
+
+COUNTERS = ["bytes_read", "bytes_written", "pages", "annotations"]
+SUMMARY_TOP = 20
+
+def empty_totals():
+    return dict({"calls": 0, "wall": 0.0, "cpu": 0.0}, **{name: 0 for name in COUNTERS})
+
+def add_totals(totals, stages):
+    for name, stats in stages.items():
+        stage_totals = totals.setdefault(name, empty_totals())
+        for key, value in stats.items():
+            stage_totals[key] += value
+
+class StageProfile:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.stages = {}  # stage -> totals for whatever is being timed right now (one file in a worker)
+        self.files = []  # {"file", "wall", "cpu", "stages"} for every job of the current or last operation
+        self.operation = None  # {"operation", "wall", "cpu", "files", "stages"} once finished
+
+    @contextmanager
+    def stage(self, name, **counts):
+        counts = dict({key: 0 for key in COUNTERS}, **counts)
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        try:
+            yield counts
+        finally:
+            totals = self.stages.setdefault(name, empty_totals())
+            totals["calls"] += 1
+            totals["wall"] += time.perf_counter() - start_wall
+            totals["cpu"] += time.process_time() - start_cpu
+            for key, value in counts.items():
+                totals[key] += value
+
+    def start_operation(self, name):
+        # Stages recorded from here (crawl, cache work) and the stages of every file run until
+        # finish_operation() are reported under this operation
+        self.reset()
+        self.operation = {"operation": name, "wall": time.perf_counter(), "cpu": time.process_time()}
+
+    def finish_operation(self):
+        stages = self.stages
+        self.stages = {}
+        for record in self.files:
+            add_totals(stages, record["stages"])
+        # cpu here is this process only; worker time is in the stage and file totals
+        self.operation.update(wall=time.perf_counter() - self.operation["wall"], cpu=time.process_time() - self.operation["cpu"],
+                              files=len(self.files), stages=stages)
+        return self.operation
+
+    def add_file(self, file_path, stats):
+        self.files.append(dict(stats, file=file_path))
+
+    def add_stages(self, stats):
+        # A job of a helper pass over files that are processed again later (triage, page counts): its stages
+        # count towards the operation, but it is not another file
+        add_totals(self.stages, stats["stages"])
+
+    def summary(self, top=SUMMARY_TOP):
+        ordered_stages = sorted(self.operation["stages"].items(), key=lambda item: item[1]["wall"], reverse=True)
+        slowest_files = sorted(self.files, key=lambda record: record["wall"], reverse=True)[:top]
+        return {
+            "operation": {key: value for key, value in self.operation.items() if key != "stages"},
+            "stages": [dict(stats, stage=name) for name, stats in ordered_stages],
+            "slowest_files": [{"file": record["file"], "wall": record["wall"], "cpu": record["cpu"],
+                               "slowest_stage": max(record["stages"], key=lambda name: record["stages"][name]["wall"]) if record["stages"] else "",
+                               "stages": record["stages"]} for record in slowest_files],
+        }
+
+PROFILE = StageProfile()
+
+def profiled_call(func, *args):
+    # Runs one job with a fresh set of stage totals and returns (result, {"wall", "cpu", "stages"}).
+    # The caller's totals are put back afterwards, so serial runs in the parent process nest correctly.
+    outer = PROFILE.stages
+    PROFILE.stages = {}
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    try:
+        result = func(*args)
+    finally:
+        stats = {"wall": time.perf_counter() - start_wall, "cpu": time.process_time() - start_cpu, "stages": PROFILE.stages}
+        PROFILE.stages = outer
+    return result, stats
+
+def write_run_summary(output_dir, top=SUMMARY_TOP):
+    # Finishes the current operation and writes "run_summary_<operation>.json" next to the other reports,
+    # with the slowest stages and files echoed to the console
+    operation = PROFILE.finish_operation()["operation"]
+    summary = PROFILE.summary(top)
+    summary_path = os.path.join(output_dir, f"run_summary_{operation}.json")
+    try:
+        with open(summary_path, "w", encoding="utf-8") as summary_file:
+            json.dump(summary, summary_file, indent=2)
+    except OSError as e:
+        print(f"Error while writing run summary: {str(e)}")
+        return None
+    for stats in summary["stages"]:
+        print(f"{stats['stage']:>12}: {stats['wall']:.3f}s wall, {stats['cpu']:.3f}s cpu, {stats['calls']} calls, "
+              f"{stats['pages']} pages, {stats['annotations']} annotations")
+    for record in summary["slowest_files"][:5]:
+        print(f"Slow file: {record['file']} {record['wall']:.3f}s ({record['slowest_stage']})")
+    print(f"Run summary written to: {summary_path}")
+    return summary_path
@@ -0,0 +1,126 @@
+import os
+import sqlite3
+
+# Full-text index over the rows of "Extracted Highlights.csv", filled by extract_library as it writes the CSV.
+# Lives next to the CSV, so searching never opens a PDF:
+#   search_highlights(r"D:\Reports", "calibration", year="2019", color="Yellow")
+
+INDEX_FILE_NAME = "Highlight Search.sqlite"
+SEARCH_LIMIT = 200
+FILTER_COLUMNS = ["year", "make", "model", "system", "color"]
+
+class HighlightIndex:
+    # One row per highlight, keyed by file and page and filterable by Year/Make/Model/System/color; the text is
+    # mirrored into an FTS5 table by triggers. Words are indexed as written, not stemmed, so a prefix query such
+    # as calibrat* finds calibrate and calibration
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS highlights (
+                id INTEGER PRIMARY KEY,
+                file TEXT,
+                year TEXT,
+                make TEXT,
+                model TEXT,
+                system TEXT,
+                color TEXT,
+                page INTEGER,
+                text TEXT
+            );
+            CREATE INDEX IF NOT EXISTS highlights_file ON highlights (file);
+            CREATE INDEX IF NOT EXISTS highlights_vehicle ON highlights (year, make, model, system, color);
+            CREATE VIRTUAL TABLE IF NOT EXISTS highlights_text USING fts5(text, content='highlights', content_rowid='id', tokenize='unicode61');
+            CREATE TRIGGER IF NOT EXISTS highlights_insert AFTER INSERT ON highlights BEGIN
+                INSERT INTO highlights_text (rowid, text) VALUES (new.id, new.text);
+            END;
+            CREATE TRIGGER IF NOT EXISTS highlights_delete AFTER DELETE ON highlights BEGIN
+                INSERT INTO highlights_text (highlights_text, rowid, text) VALUES ('delete', old.id, old.text);
+            END;
+        """)
+        self.conn.commit()
+
+    @classmethod
+    def for_output(cls, output_dir):
+        return cls(os.path.join(output_dir, INDEX_FILE_NAME))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def commit(self):
+        self.conn.commit()
+
+    def replace_file(self, file_path, rows):
+        # Re-indexing a file replaces whatever an earlier run stored for it
+        self.conn.execute("DELETE FROM highlights WHERE file = ?", (file_path,))
+        self.conn.executemany("INSERT INTO highlights (file, year, make, model, system, color, page, text) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                              [(file_path, row["Year"], row["Make"], row["Model"], row["System"], row["HighlightColor"], row.get("Page"), row["Text"])
+                               for row in rows])
+
+    def has_file(self, file_path):
+        return self.conn.execute("SELECT 1 FROM highlights WHERE file = ? LIMIT 1", (file_path,)).fetchone() is not None
+
+    def library_rows(self, input_path):
+        # Every row indexed for files under input_path in library (path) order, each file's rows in the order stored
+        prefix = os.path.join(input_path, "")
+        return [{"Year": row[1], "Make": row[2], "Model": row[3], "System": row[4], "HighlightColor": row[5], "Page": row[6], "Text": row[7]}
+                for row in self.conn.execute("SELECT file, year, make, model, system, color, page, text FROM highlights ORDER BY file, id")
+                if row[0].startswith(prefix)]
+
+    def prune(self, input_path, file_paths):
+        # Drops files under input_path that are no longer in the library; other libraries sharing the index are kept
+        known = set(file_paths)
+        prefix = os.path.join(input_path, "")
+        stale = [(file_path,) for (file_path,) in self.conn.execute("SELECT DISTINCT file FROM highlights")
+                 if file_path.startswith(prefix) and file_path not in known]
+        self.conn.executemany("DELETE FROM highlights WHERE file = ?", stale)
+        return len(stale)
+
+    def search(self, query="", limit=SEARCH_LIMIT, **filters):
+        # Rows whose text matches every word of query (a trailing * matches any ending), best matches first,
+        # narrowed by exact year/make/model/system/color. An empty query lists the filtered rows in library order.
+        conditions = []
+        params = []
+        for column in FILTER_COLUMNS:
+            if filters.get(column):
+                conditions.append(f"highlights.{column} = ? COLLATE NOCASE")
+                params.append(str(filters[column]))
+        columns = "highlights.file, highlights.year, highlights.make, highlights.model, highlights.system, highlights.color, highlights.page, highlights.text"
+        match = match_expression(query)
+        if match:
+            sql = (f"SELECT {columns} FROM highlights_text JOIN highlights ON highlights.id = highlights_text.rowid "
+                   f"WHERE highlights_text MATCH ?{''.join(' AND ' + condition for condition in conditions)} ORDER BY highlights_text.rank LIMIT ?")
+            params.insert(0, match)
+        else:
+            sql = f"SELECT {columns} FROM highlights{' WHERE ' + ' AND '.join(conditions) if conditions else ''} ORDER BY highlights.id LIMIT ?"
+        params.append(limit)
+        return [{"File": row[0], "Year": row[1], "Make": row[2], "Model": row[3], "System": row[4], "HighlightColor": row[5], "Page": row[6], "Text": row[7]}
+                for row in self.conn.execute(sql, params)]
+
+def match_expression(query):
+    # Plain words -> an FTS5 query that needs all of them, with quotes so punctuation can't break the syntax
+    terms = []
+    for word in query.split():
+        prefix = word.endswith("*")
+        word = word.rstrip("*").replace('"', '""')
+        if word:
+            terms.append(f'"{word}"' + ("*" if prefix else ""))
+    return " ".join(terms)
+
+def index_path(location):
+    # The index file itself, or the folder holding it (where Extracted Highlights.csv was written)
+    return location if os.path.isfile(location) else os.path.join(location, INDEX_FILE_NAME)
+
+def search_highlights(location, query="", limit=SEARCH_LIMIT, **filters):
+    db_path = index_path(location)
+    if not os.path.exists(db_path):
+        raise FileNotFoundError(f"No highlight index at {db_path}; run Extract Highlights first")
+    with HighlightIndex(db_path) as index:
+        return index.search(query, limit, **filters)
@@ -0,0 +1,401 @@
+import os
+import re
+import csv
+import json
+import time
+import uuid
+import socket
+import threading
+from si_profile import PROFILE, write_run_summary
+from si_search import HighlightIndex
+from si_core import (HIGHLIGHT_FIELDS, SPLIT_PART_KB, DEFAULT_PRESET, default_classifier, library_entries, timed_crawl, triage_files,
+                     iter_parallel, extract_file_highlights, compress_pdf, file_record, compress_record, write_oversized_report,
+                     manifest_entry, OPEN_FAILED_ROW)
+
+# Several machines working through one library on a shared drive. Every node runs the same command with the same
+# --ledger folder, and they split the work through files in that folder, with no server involved:
+#   plan.json           the library cut into shards (one per Make/Year/Model folder), written by the first node to crawl
+#   leases/<name>.json  which node holds a shard and until when; renewed while it works, taken over once it expires
+#   results/<id>.jsonl  one line per finished file, so a node taking over a crashed node's shard skips those files
+#   done/<id>           the shard is complete
+# Once every shard is done, one node merges the results into the usual report files in the output folder.
+# Paths in the ledger are relative to the library folder, so nodes may mount the share under different paths.
+# Leases expire by wall clock, so the nodes' clocks must agree to well within LEASE_SECONDS (domain time or NTP).
+#   python si_cli.py extract-highlights "Z:\OEM" --output "Z:\Reports" --ledger "Z:\Reports\ledger"
+
+LEASE_SECONDS = 600  # A node that has not renewed its lease for this long is presumed dead
+POLL_SECONDS = 30  # How often a node with nothing to claim checks for finished or expired shards
+OPERATIONS = ["compress", "extract-highlights"]
+
+def node_name():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+def read_json(path):
+    try:
+        with open(path, encoding="utf-8") as json_file:
+            return json.load(json_file)
+    except (OSError, ValueError):
+        return None
+
+def read_lease_file(path):
+    # (raw bytes, mtime) of a lease file, or None when there is none
+    try:
+        with open(path, "rb") as lease_file:
+            return lease_file.read(), os.fstat(lease_file.fileno()).st_mtime_ns
+    except OSError:
+        return None
+
+def parse_lease(data):
+    try:
+        return json.loads(data)
+    except ValueError:
+        return None  # Just created and not written yet, or torn by a crash
+
+def write_json_atomic(path, data):
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as json_file:
+        json.dump(data, json_file)
+    os.replace(temp_path, path)
+
+class Lease:
+    # A claimed lease, renewed every third of its lifetime by a background thread while the holder works.
+    # lost turns True if another node took it over (this node stalled past the expiry), and the holder stops.
+    # The lease file is only rewritten or removed while it is ours and a third of its lifetime from expiring:
+    # nobody takes over a lease before it expires, so that check can't race a takeover. Closer than that,
+    # the node gives the lease up instead.
+    def __init__(self, ledger, name, token):
+        self.ledger = ledger
+        self.name = name
+        self.token = token
+        self.path = ledger.lease_path(name)
+        self.lost = False
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+    def run(self):
+        while not self.stopped.wait(self.ledger.lease_seconds / 3):
+            self.renew()
+
+    def held(self):
+        current = read_json(self.path)
+        return current is not None and current.get("token") == self.token
+
+    def safe_to_write(self):
+        current = read_json(self.path)
+        return current is not None and current.get("token") == self.token and current.get("expires", 0) - time.time() > self.ledger.lease_seconds / 3
+
+    def renew(self):
+        if not self.safe_to_write():
+            self.lost = True
+            print(f"Lost the lease on {self.name}; another node may take it over")
+            return
+        try:
+            write_json_atomic(self.path, self.ledger.lease_record(self.token))
+        except OSError as e:
+            print(f"Could not renew the lease on {self.name}: {str(e)}")
+
+    def release(self):
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        if not self.lost and self.safe_to_write():
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass  # Expires on its own
+
+class Ledger:
+    def __init__(self, ledger_path, lease_seconds=LEASE_SECONDS, node=None):
+        self.ledger_path = ledger_path
+        self.lease_seconds = lease_seconds
+        self.node = node or node_name()
+        for folder in ("leases", "results", "done"):
+            os.makedirs(os.path.join(ledger_path, folder), exist_ok=True)
+
+    def lease_path(self, name):
+        return os.path.join(self.ledger_path, "leases", f"{name}.json")
+
+    def results_path(self, shard_id):
+        return os.path.join(self.ledger_path, "results", f"{shard_id}.jsonl")
+
+    def done_path(self, name):
+        return os.path.join(self.ledger_path, "done", name)
+
+    def lease_record(self, token):
+        return {"node": self.node, "token": token, "expires": time.time() + self.lease_seconds}
+
+    def claim(self, name):
+        # A Lease if this node now holds name, None if a live node does. Creating the file with O_EXCL is the lock;
+        # an expired lease is first renamed aside, which only one of the nodes racing for it can do. Another node
+        # may have taken it over between our read and our rename, so what was renamed must be the very file
+        # judged expired; if not, it is that node's fresh lease and goes back.
+        path = self.lease_path(name)
+        token = uuid.uuid4().hex
+        for _ in range(2):
+            try:
+                lease_fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                seen = read_lease_file(path)
+                if seen is None:
+                    continue  # Released meanwhile
+                current = parse_lease(seen[0])
+                if current is None:
+                    if time.time() - seen[1] / 1e9 < self.lease_seconds:
+                        return None  # Judged by its age
+                elif current.get("expires", 0) > time.time():
+                    return None
+                aside_path = f"{path}.{token}.expired"
+                try:
+                    os.rename(path, aside_path)
+                except OSError:
+                    return None  # Another node is taking it over
+                if read_lease_file(aside_path) != seen:
+                    self.put_back(aside_path, path)
+                    return None
+                try:
+                    os.remove(aside_path)
+                except OSError:
+                    pass
+                print(f"Taking over {name} from {current.get('node') if current else 'a node that crashed'}")
+                continue
+            with os.fdopen(lease_fd, "w", encoding="utf-8") as lease_file:
+                json.dump(self.lease_record(token), lease_file)
+            return Lease(self, name, token)
+        return None
+
+    def put_back(self, aside_path, path):
+        # Returns another node's lease renamed aside by mistake. O_EXCL, so a lease created meanwhile is not overwritten;
+        # the owner then finds its token gone and gives the shard up.
+        try:
+            with open(aside_path, "rb") as aside_file:
+                data = aside_file.read()
+            lease_fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            with os.fdopen(lease_fd, "wb") as lease_file:
+                lease_file.write(data)
+        except OSError:
+            pass
+        try:
+            os.remove(aside_path)
+        except OSError:
+            pass
+
+    def is_done(self, name):
+        return os.path.exists(self.done_path(name))
+
+    def mark_done(self, name):
+        write_json_atomic(self.done_path(name), {"node": self.node, "finished": time.time()})
+
+    def read_results(self, shard_id):
+        # Relative path -> result line; a line torn by a crash is ignored and its file done again
+        results = {}
+        try:
+            with open(self.results_path(shard_id), encoding="utf-8") as results_file:
+                for line in results_file:
+                    try:
+                        result = json.loads(line)
+                    except ValueError:
+                        continue
+                    results[result["file"]] = result
+        except OSError:
+            pass
+        return results
+
+    def load_plan(self, operation, build_plan):
+        # The first node to claim "plan" crawls and writes plan.json; the others wait for it
+        plan_path = os.path.join(self.ledger_path, "plan.json")
+        while True:
+            plan = read_json(plan_path)
+            if plan is not None:
+                if plan["operation"] != operation:
+                    raise ValueError(f"The ledger at {self.ledger_path} belongs to a {plan['operation']} run; use another folder for {operation}")
+                return plan
+            lease = self.claim("plan")
+            if lease is None:
+                print("Waiting for another node to plan the shards")
+                time.sleep(min(POLL_SECONDS, self.lease_seconds / 4))
+                continue
+            with lease:
+                if read_json(plan_path) is None:
+                    write_json_atomic(plan_path, dict(build_plan(), operation=operation, planned_by=self.node))
+
+def relative_path(input_path, file_path):
+    return os.path.relpath(file_path, input_path).replace(os.sep, "/")
+
+def local_path(input_path, relative):
+    return os.path.join(input_path, *relative.split("/"))
+
+def plan_shards(input_path, operation):
+    # One shard per Make/Year/Model folder, in crawl order. Compress also takes the PDFs above the Model level,
+    # one shard per folder.
+    manifest = timed_crawl(input_path)
+    entries = library_entries(manifest) if operation == "extract-highlights" else manifest
+    shards = {}
+    for entry in entries:
+        relative = relative_path(input_path, entry.path)
+        key = "/".join([entry.make, entry.year, entry.model]) if entry.model is not None else os.path.dirname(relative) or "."
+        shards.setdefault(key, []).append(relative)
+    return {"shards": [{"id": f"{number:05d} {re.sub(r'[^A-Za-z0-9.-]+', '_', key)}", "files": files}
+                       for number, (key, files) in enumerate(shards.items(), 1)]}
+
+def run_shard(ledger, lease, operation, shard, input_path, workers, progress_file, cancelled, on_error, classifier, max_part_kb, preset, memory_limit_mb):
+    # Processes the files of shard that have no result yet, appending a result line per file.
+    # True once every file of the shard has one.
+    finished = ledger.read_results(shard["id"])
+    relatives = [relative for relative in shard["files"] if relative not in finished]
+    paths = [local_path(input_path, relative) for relative in relatives]
+    stop = lambda: lease.lost or (cancelled is not None and cancelled())
+    results_path = ledger.results_path(shard["id"])
+    if os.path.exists(results_path) and os.path.getsize(results_path):
+        with open(results_path, "rb") as results_file:
+            results_file.seek(-1, os.SEEK_END)
+            torn = results_file.read(1) != b"\n"
+    else:
+        torn = False
+    with open(results_path, "a", encoding="utf-8") as results_file:
+        if torn:
+            results_file.write("\n")
+
+        def record(job_index, status, error="", **payload):
+            if error and on_error:
+                on_error(paths[job_index], error)
+            results_file.write(json.dumps(dict({"file": relatives[job_index], "status": status, "error": error, "node": ledger.node}, **payload)) + "\n")
+            results_file.flush()
+            os.fsync(results_file.fileno())
+            progress_file(paths[job_index])
+
+        if operation == "extract-highlights":
+            skipped = triage_files(paths, workers, stop)
+            for job_index in sorted(skipped):
+                record(job_index, "no highlights", rows=[])
+            jobs = [job_index for job_index in range(len(paths)) if job_index not in skipped]
+            for position, highlights, error in iter_parallel(extract_file_highlights, [(paths[job_index], classifier, memory_limit_mb) for job_index in jobs], workers, stop, True, memory_limit_mb):
+                if not error and highlights is None:
+                    # The same placeholder row a single-machine run writes to the CSV
+                    record(jobs[position], "failed", "Could not open file.", rows=[OPEN_FAILED_ROW])
+                    continue
+                record(jobs[position], "failed" if error else "extracted", error, rows=highlights or [])
+        else:
+            for job_index, result, error in iter_parallel(compress_pdf, [(path, max_part_kb, preset, memory_limit_mb) for path in paths], workers, stop, True, memory_limit_mb):
+                error = error or (result and result["error"])
+                if result:
+                    result = dict(result, path=relatives[job_index], part_paths=[relative_path(input_path, part) for part in result["part_paths"]])
+                record(job_index, "failed" if error else "done", error, result=None if error else result)
+    return all(relative in ledger.read_results(shard["id"]) for relative in shard["files"])
+
+def merge_records(ledger, plan, operation, input_path):
+    # One record per PDF of the whole library, in crawl order, from the results of every shard
+    records = []
+    for shard in plan["shards"]:
+        results = ledger.read_results(shard["id"])
+        for relative in shard["files"]:
+            result = results.get(relative, {"status": "not run", "error": "", "rows": [], "result": None})
+            file_path = local_path(input_path, relative)
+            record = file_record(file_path, result["status"], result["error"])
+            if operation == "extract-highlights":
+                record["Rows"] = result["rows"]
+            elif result["result"]:
+                # Stored relative so the merging node can rebuild the paths under its own mount
+                record = dict(compress_record(file_path, result["result"]), Result=dict(result["result"], path=file_path,
+                              part_paths=[local_path(input_path, part) for part in result["result"]["part_paths"]]))
+            records.append(record)
+    return records
+
+def merge_results(records, operation, input_path, output_dir):
+    # Writes the single report of the distributed run, the same files a run on one machine writes
+    if operation == "compress":
+        write_oversized_report([record.get("Result") for record in records], output_dir, [manifest_entry(input_path, record["File"]) for record in records])
+        return
+    output_csv_path = os.path.join(output_dir, "Extracted Highlights.csv")
+    with HighlightIndex.for_output(output_dir) as search_index:
+        with open(output_csv_path + ".tmp", "w", newline="", encoding="utf-8") as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=HIGHLIGHT_FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            for record in records:
+                writer.writerows(record["Rows"])
+                # A file that could not be opened only has its placeholder row in the CSV, as in extract_library
+                search_index.replace_file(record["File"], [] if record["Rows"] == [OPEN_FAILED_ROW] else record["Rows"])
+        os.replace(output_csv_path + ".tmp", output_csv_path)
+        search_index.prune(input_path, [record["File"] for record in records])
+    print(f"Total highlights found: {sum(len(record['Rows']) for record in records)}")
+    print(f"Highlights saved to {output_csv_path}")
+
+def wait(seconds, cancelled):
+    end = time.time() + seconds
+    while time.time() < end:
+        if cancelled is not None and cancelled():
+            return
+        time.sleep(1)
+
+def run_distributed(operation, input_path, output_dir, ledger_path, workers=1, progress=None, cancelled=None, on_error=None, classifier=None,
+                    max_part_kb=SPLIT_PART_KB, preset=DEFAULT_PRESET, memory_limit_mb=None, lease_seconds=LEASE_SECONDS):
+    # One node's part of a distributed compress or extract-highlights run. Returns one record per PDF of the
+    # whole library once the merged report exists; when cancelled, files nobody finished yet are "not run".
+    if operation not in OPERATIONS:
+        raise ValueError(f"{operation} can't be run distributed; choose from {', '.join(OPERATIONS)}")
+    PROFILE.start_operation(operation)
+    ledger = Ledger(ledger_path, lease_seconds)
+    classifier = classifier or default_classifier
+    plan = ledger.load_plan(operation, lambda: plan_shards(input_path, operation))
+    shards = plan["shards"]
+    total_files = sum(len(shard["files"]) for shard in shards)
+    processed_files = sum(len(shard["files"]) for shard in shards if ledger.is_done(shard["id"]))
+    print(f"Node {ledger.node}: {len(shards)} shards, {total_files} files, {processed_files} already done")
+
+    def progress_file(file_path):
+        nonlocal processed_files
+        processed_files += 1
+        if progress:
+            progress(processed_files, total_files, file_path)
+
+    poll_seconds = min(POLL_SECONDS, lease_seconds / 4)
+    while not (cancelled is not None and cancelled()):
+        remaining = [shard for shard in shards if not ledger.is_done(shard["id"])]
+        if not remaining:
+            if ledger.is_done("merged"):
+                print("Every shard is done and the results are merged")
+                break
+            lease = ledger.claim("merge")
+            if lease is None:
+                print("Waiting for another node to merge the results")
+                wait(poll_seconds, cancelled)
+                continue
+            with lease:
+                if not ledger.is_done("merged"):
+                    merge_results(merge_records(ledger, plan, operation, input_path), operation, input_path, output_dir)
+                    ledger.mark_done("merged")
+            continue
+        claimed = False
+        for shard in remaining:
+            if cancelled is not None and cancelled():
+                break
+            if ledger.is_done(shard["id"]):
+                continue
+            lease = ledger.claim(f"shard {shard['id']}")
+            if lease is None:
+                continue
+            claimed = True
+            print(f"Processing shard {shard['id']} ({len(shard['files'])} files)")
+            with lease:
+                complete = run_shard(ledger, lease, operation, shard, input_path, workers, progress_file, cancelled, on_error, classifier, max_part_kb, preset, memory_limit_mb)
+                if complete and not lease.lost:
+                    ledger.mark_done(shard["id"])
+        if not claimed:
+            print(f"Waiting for {len(remaining)} shards held by other nodes")
+            wait(poll_seconds, cancelled)
+    # Each node keeps its own run summary in the ledger
+    node_dir = os.path.join(ledger_path, "nodes", ledger.node)
+    os.makedirs(node_dir, exist_ok=True)
+    write_run_summary(node_dir)
+    records = merge_records(ledger, plan, operation, input_path)
+    for record in records:
+        record.pop("Rows", None)
+        record.pop("Result", None)
+    return records
+
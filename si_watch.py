@@ -0,0 +1,265 @@
+import os
+import csv
+import json
+import time
+import threading
+from si_search import HighlightIndex
+from si_core import (COPY_MODES, HIGHLIGHT_FIELDS, SPLIT_PART_KB, DEFAULT_PRESET, default_classifier, crawl_library, iter_parallel, compress_pdf,
+                     extract_file_highlights, copy_highlighted_pages, file_record, compress_record, append_oversized_report,
+                     manifest_entry)
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None  # Optional: without it the library is polled
+    FileSystemEventHandler = object
+
+# Long-running watch mode: PDFs that are added to or changed in the library are compressed (and split), their
+# highlights appended to Extracted Highlights.csv and the search index, and their highlighted pages copied,
+# a few seconds after they land instead of at the next full run.
+#   python si_cli.py watch "D:\OEM Library" --output "D:\Reports" --copy-to "D:\Copies"
+# Changes come from filesystem events through watchdog when it is installed (inotify, ReadDirectoryChangesW, ...),
+# otherwise, or with --poll (network drives often deliver no events), from re-crawling every POLL_SECONDS.
+# A file is only picked up once its size and mtime have held still for DEBOUNCE_SECONDS and it can be opened,
+# so half-copied files are left alone. The state file remembers what has been seen, so after a restart files
+# that changed while nothing was watching are caught up.
+
+DEBOUNCE_SECONDS = 5
+POLL_SECONDS = 10
+RESCAN_SECONDS = 600  # Full re-crawl even with events, in case some were lost
+RETRY_SECONDS = 30  # Wait before a failed file is tried again; doubles with every failure, up to RESCAN_SECONDS
+TICK_SECONDS = 1
+STATE_FILE_NAME = "SI MultiTool Watch.json"
+
+def file_signature(file_path):
+    stat = os.stat(file_path)
+    return [stat.st_size, stat.st_mtime]
+
+def can_read(file_path):
+    # A file still being copied in is locked on Windows
+    try:
+        with open(file_path, "rb") as pdf_file:
+            pdf_file.read(1)
+        return True
+    except OSError:
+        return False
+
+class ChangeHandler(FileSystemEventHandler):
+    def __init__(self, watcher):
+        self.watcher = watcher
+
+    def on_any_event(self, event):
+        path = getattr(event, "dest_path", "") or event.src_path
+        if event.is_directory:
+            if event.event_type in ("created", "moved"):
+                self.watcher.note(path, True)  # A folder moved in brings its PDFs without an event for each
+        elif event.event_type in ("created", "modified", "moved", "closed"):
+            self.watcher.note(path, False)
+
+class FolderWatcher:
+    # Collects new and changed PDFs under input_path and hands them out once they stopped changing.
+    # known is path -> [size, mtime] of everything already handled; matching files are never handed out again,
+    # which also keeps the watcher from picking up the files it just rewrote itself. A file that failed is not
+    # known and is handed out again after a back-off (see RETRY_SECONDS).
+    def __init__(self, input_path, known, ignore_paths=(), debounce_seconds=DEBOUNCE_SECONDS, poll_seconds=POLL_SECONDS, use_events=True):
+        self.input_path = input_path
+        self.known = known
+        self.ignore_prefixes = [os.path.join(os.path.abspath(path), "") for path in ignore_paths if path]
+        self.debounce_seconds = debounce_seconds
+        self.poll_seconds = poll_seconds
+        self.pending = {}  # path -> [size, mtime, time the signature was first seen]
+        self.lock = threading.Lock()
+        self.noted = set()  # (path, is_directory) from the event thread
+        self.retries = {}  # path -> [failures, time it may be handed out again]
+        self.observer = None
+        if use_events and Observer is not None:
+            self.observer = Observer()
+            self.observer.schedule(ChangeHandler(self), input_path, recursive=True)
+            self.observer.start()
+        self.next_crawl = 0  # Crawl straight away to catch up on what changed while nobody was watching
+
+    def wanted(self, path):
+        return path.lower().endswith(".pdf") and not any(os.path.abspath(path).startswith(prefix) for prefix in self.ignore_prefixes)
+
+    def note(self, path, is_directory):
+        with self.lock:
+            self.noted.add((path, is_directory))
+
+    def add(self, path):
+        if self.wanted(path) and path not in self.pending:
+            self.pending[path] = None  # Signature taken on the next check
+
+    def failed(self, path):
+        failures = self.retries.get(path, [0, 0])[0] + 1
+        self.retries[path] = [failures, time.time() + min(RETRY_SECONDS * 2 ** (failures - 1), RESCAN_SECONDS)]
+        self.add(path)
+
+    def succeeded(self, path):
+        self.retries.pop(path, None)
+
+    def crawl(self):
+        for entry in crawl_library(self.input_path):
+            if self.known.get(entry.path) != [entry.size, entry.mtime]:
+                self.add(entry.path)
+        self.next_crawl = time.time() + (RESCAN_SECONDS if self.observer is not None else self.poll_seconds)
+
+    def ready(self):
+        # Paths that are new or changed and have been still for debounce_seconds, in path order
+        with self.lock:
+            noted, self.noted = self.noted, set()
+        for path, is_directory in noted:
+            if is_directory:
+                for dir_path, _, file_names in os.walk(path):
+                    for file_name in file_names:
+                        self.add(os.path.join(dir_path, file_name))
+            else:
+                self.add(path)
+        if time.time() >= self.next_crawl:
+            self.crawl()
+        now = time.time()
+        ready = []
+        for path, seen in list(self.pending.items()):
+            try:
+                signature = file_signature(path)
+            except OSError:
+                del self.pending[path]  # Deleted or moved away again
+                continue
+            if self.known.get(path) == signature:
+                del self.pending[path]
+            elif seen is None or seen[:2] != signature:
+                self.pending[path] = signature + [now]
+            elif now - seen[2] >= self.debounce_seconds and now >= self.retries.get(path, [0, 0])[1] and can_read(path):
+                ready.append(path)
+                del self.pending[path]
+        return sorted(ready)
+
+    def stop(self):
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join()
+
+def in_library(input_path, file_path):
+    # Inside a Make/Year/Model folder, the files the highlight operations work on
+    return len(os.path.relpath(file_path, input_path).split(os.sep)) > 3
+
+def process_arrival(file_path, library, compress, max_part_kb, preset, extract, copy_to, modes, classifier, memory_limit_mb):
+    # Everything watch mode does for one new or changed PDF; runs in a worker process.
+    # A split file's parts take its place for the highlight steps.
+    outcome = {"compress": None, "files": [file_path], "highlights": {}, "error": ""}
+    if compress:
+        outcome["compress"] = compress_pdf(file_path, max_part_kb, preset, memory_limit_mb)
+        outcome["error"] = outcome["compress"]["error"]
+        if outcome["compress"]["split"]:
+            outcome["files"] = outcome["compress"]["part_paths"]
+    if library and not outcome["error"]:
+        for path in outcome["files"]:
+            if extract:
+                outcome["highlights"][path] = extract_file_highlights(path, classifier, memory_limit_mb)
+                if outcome["highlights"][path] is None:
+                    outcome["error"] = f"Could not open {path}"
+                    break
+            if copy_to and copy_highlighted_pages(path, copy_to, modes, None, classifier, memory_limit_mb) is None:
+                outcome["error"] = f"Could not open {path}"
+                break
+    return outcome
+
+def load_state(state_path, input_path):
+    try:
+        with open(state_path, encoding="utf-8") as state_file:
+            state = json.load(state_file)
+    except (OSError, ValueError):
+        return None
+    return state["files"] if state.get("input") == input_path else None
+
+def save_state(state_path, input_path, known):
+    with open(state_path + ".tmp", "w", encoding="utf-8") as state_file:
+        json.dump({"input": input_path, "files": known}, state_file)
+    os.replace(state_path + ".tmp", state_path)
+
+def append_highlight_rows(csv_path, rows):
+    new_file = not os.path.exists(csv_path) or os.path.getsize(csv_path) == 0
+    with open(csv_path, "a", newline="", encoding="utf-8") as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=HIGHLIGHT_FIELDS, extrasaction="ignore")
+        if new_file:
+            writer.writeheader()
+        writer.writerows(rows)
+
+def rewrite_highlight_csv(csv_path, rows):
+    with open(csv_path + ".tmp", "w", newline="", encoding="utf-8") as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=HIGHLIGHT_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(csv_path + ".tmp", csv_path)
+
+def watch_library(input_path, output_dir, compress=True, extract=True, copy_to=None, modes=COPY_MODES, workers=1, progress=None, cancelled=None, on_error=None,
+                  classifier=None, max_part_kb=SPLIT_PART_KB, preset=DEFAULT_PRESET, memory_limit_mb=None, debounce_seconds=DEBOUNCE_SECONDS,
+                  poll_seconds=POLL_SECONDS, use_events=True):
+    # Runs until cancelled() (or Ctrl+C) and returns a record per file processed. The first run only records
+    # what is already in the library; run compress/extract-highlights once for that.
+    classifier = classifier or default_classifier
+    state_path = os.path.join(output_dir, STATE_FILE_NAME)
+    known = load_state(state_path, input_path)
+    if known is None:
+        known = {entry.path: [entry.size, entry.mtime] for entry in crawl_library(input_path)}
+        save_state(state_path, input_path, known)
+        print(f"Watching {input_path}: {len(known)} PDFs already there are left as they are")
+    output_csv_path = os.path.join(output_dir, "Extracted Highlights.csv")
+    search_index = HighlightIndex.for_output(output_dir) if extract else None
+    watcher = FolderWatcher(input_path, known, [output_dir if os.path.abspath(output_dir) != os.path.abspath(input_path) else None, copy_to],
+                            debounce_seconds, poll_seconds, use_events)
+    print(f"Watching {input_path} for new or changed PDFs ({'filesystem events' if watcher.observer is not None else f'polling every {poll_seconds}s'})")
+    records = []
+    try:
+        while not (cancelled is not None and cancelled()):
+            ready = watcher.ready()
+            if not ready:
+                time.sleep(TICK_SECONDS)
+                continue
+            print(f"Processing {len(ready)} new or changed PDFs")
+            jobs = [(path, in_library(input_path, path), compress, max_part_kb, preset, extract, copy_to, modes, classifier, memory_limit_mb) for path in ready]
+            rewrite_csv = False
+            # Stage timings add up, but no per-file record is kept: the loop runs until stopped
+            for index, outcome, error in iter_parallel(process_arrival, jobs, workers, cancelled, record_files=False):
+                file_path = ready[index]
+                error = error or outcome["error"]
+                if error:
+                    print(f"Error while processing {file_path}: {error}")
+                    records.append(file_record(file_path, "failed", error))
+                    if on_error:
+                        on_error(file_path, error)
+                else:
+                    records.append(compress_record(file_path, outcome["compress"]) if outcome["compress"] else file_record(file_path, "processed"))
+                    if outcome["compress"] and outcome["compress"]["oversized"]:
+                        append_oversized_report(outcome["compress"], output_dir, manifest_entry(input_path, file_path))
+                    for path, rows in outcome["highlights"].items():
+                        # A file reported before is replaced in the index, and the CSV is rebuilt from it below
+                        rewrite_csv = rewrite_csv or search_index.has_file(path)
+                        search_index.replace_file(path, rows or [])
+                        if not rewrite_csv:
+                            append_highlight_rows(output_csv_path, rows or [])
+                        print(f"{os.path.basename(path)}: {len(rows or [])} highlights")
+                # Whatever the processing left behind is the new baseline, so it is not picked up again.
+                # A failure may only be the share for a moment: the file stays unknown and is tried again.
+                known.pop(file_path, None)
+                for path in (outcome["files"] if outcome else [file_path]):
+                    if error:
+                        watcher.failed(path)
+                        continue
+                    watcher.succeeded(path)
+                    try:
+                        known[path] = file_signature(path)
+                    except OSError:
+                        pass
+                if progress:
+                    progress(len(records), len(records) + len(watcher.pending), file_path)
+            if search_index is not None:
+                if rewrite_csv:
+                    rewrite_highlight_csv(output_csv_path, search_index.library_rows(input_path))
+                search_index.commit()
+            save_state(state_path, input_path, known)
+    finally:
+        watcher.stop()
+        if search_index is not None:
+            search_index.close()
+        save_state(state_path, input_path, known)
+    return records
@@ -0,0 +1,420 @@
+import os
+import csv
+import json
+import time
+import random
+import pytest
+import si_core
+import si_cache
+import si_cli
+import si_shard
+import si_watch
+from si_bench import generate_corpus, make_document, synthetic_image
+from si_search import match_expression
+from si_core import (PageColorIndex, HighlightCsvWriter, HIGHLIGHT_FIELDS, PART_OVERHEAD_BYTES, PAGE_OVERHEAD_BYTES, page_ranges, window_ranges,
+                     plan_split_parts, iter_parallel, extract_library)
+
+# Small checks of the helpers the library operations are built from, on PDFs made by si_bench.
+#   python -m pytest -q
+
+@pytest.fixture(scope="module")
+def corpus(tmp_path_factory):
+    root = str(tmp_path_factory.mktemp("library"))
+    generate_corpus(root, makes=1, years=1, models=2, files_per_model=2, pages=6, yellow_density=0.6, blue_density=0.4)
+    return root
+
+def crash_on(value, crash_value):
+    if value == crash_value:
+        os._exit(1)  # Kills the worker process, which breaks the pool
+    time.sleep(0.02)  # Long enough for later jobs to be queued behind it when it breaks
+    return value * 2
+
+def split_test_document(path, fonts=("helv", "tiro", "cour", "symb", "hebo", "tibo"), image_size=160):
+    # A page per font, each embedding its font program and drawing an image with a noisy soft mask (SMask)
+    import fitz
+    rnd = random.Random(2)
+    doc = fitz.open()
+    for font_num, font_name in enumerate(fonts):
+        page = doc.new_page()
+        page.insert_font(fontname=f"F{font_num}", fontbuffer=fitz.Font(font_name).buffer)
+        page.insert_text((72, 72), "calibrate sensor", fontname=f"F{font_num}")
+        image = fitz.Pixmap(synthetic_image(rnd, image_size), 1)
+        image.set_alpha(bytes(rnd.randrange(256) for _ in range(image_size * image_size)))
+        page.insert_image(fitz.Rect(72, 100, 400, 428), pixmap=image)
+    doc.save(path, deflate=True)
+    doc.close()
+
+def read_rows(csv_path):
+    with open(csv_path, newline="", encoding="utf-8") as csv_file:
+        return list(csv.DictReader(csv_file))
+
+def test_page_ranges():
+    assert page_ranges([]) == []
+    assert page_ranges([0, 1, 2, 6, 7, 9]) == [(0, 2), (6, 7), (9, 9)]
+
+def test_window_ranges():
+    assert list(window_ranges([(0, 9), (20, 21)], 4)) == [(0, 3), (4, 7), (8, 9), (20, 21)]
+    assert list(window_ranges([(5, 5)], 1)) == [(5, 5)]
+
+def test_page_color_index():
+    index = PageColorIndex({0: {"Yellow"}, 1: {"Yellow", "Blue"}, 3: {"Blue"}, 4: {"Green"}})
+    assert index.select("Yellow") == [0, 1]
+    assert index.select("Blue") == [1, 3]
+    assert index.select("YB") == [0, 1, 3]
+    assert index.select("Both") == [1]
+    assert index.select("YellowOnly") == [0]
+    assert index.select("Green") == [4]
+    assert PageColorIndex({0: {"Yellow"}}).select("YB") == []
+
+def test_plan_split_parts():
+    # Three pages of 400 KB each plus one font every page shares, which is only counted once per part
+    page_xrefs = [{1, 10}, {2, 10}, {3, 10}]
+    xref_sizes = {1: 400 * 1024, 2: 400 * 1024, 3: 400 * 1024, 10: 100 * 1024}
+    assert plan_split_parts(page_xrefs, xref_sizes, 1000) == [(0, 1), (2, 2)]
+    assert plan_split_parts(page_xrefs, xref_sizes, 1400) == [(0, 2)]
+    assert plan_split_parts(page_xrefs, xref_sizes, 100) == [(0, 0), (1, 1), (2, 2)]  # Oversize pages get a part each
+    assert plan_split_parts([], {}, 100) == []
+    budget = PART_OVERHEAD_BYTES + 2 * (PAGE_OVERHEAD_BYTES + 400 * 1024) + 100 * 1024
+    assert plan_split_parts(page_xrefs, xref_sizes, budget / 1024) == [(0, 1), (2, 2)]
+
+def test_schedule_jobs():
+    costs = [1, 5, 2, 9, 3, 4]
+    assert si_core.schedule_jobs(costs, 1) == [0, 1, 2, 3, 4, 5]
+    assert si_core.schedule_jobs(costs, 2) == [3, 1, 5, 4, 2, 0]
+    assert si_core.schedule_jobs(costs, 2, 3) == [1, 2, 0, 3, 5, 4]  # Longest first within each run of three
+    assert si_core.schedule_jobs([], 2, 3) == []
+
+def test_parse_palette():
+    assert si_core.parse_palette("Yellow=1,1,0; Green = 0,1,0;") == {"Yellow": (1.0, 1.0, 0.0), "Green": (0.0, 1.0, 0.0)}
+    for text in ("Yellow", "Blue=0,0", "Blue=0,0,2", "Blue=a,b,c", "=0,0,1", ";"):
+        with pytest.raises(ValueError):
+            si_core.parse_palette(text)
+
+def test_match_expression():
+    assert match_expression("calibrate sensor") == '"calibrate" "sensor"'
+    assert match_expression("calibrat*") == '"calibrat"*'
+    assert match_expression('say "hi" *') == '"say" """hi"""'
+    assert match_expression("") == ""
+
+def test_highlight_csv_writer_resume(tmp_path):
+    csv_path = str(tmp_path / "Extracted Highlights.csv")
+    file_paths = [f"file{number}.pdf" for number in range(5)]
+    rows = {path: [{"Year": "2019", "Text": f"{path} row {row}"} for row in range(2)] for path in file_paths}
+    writer = HighlightCsvWriter(csv_path, "library", file_paths, flush_every=2)
+    for path in file_paths[:3]:
+        writer.write_file_rows(path, rows[path])
+    writer.csv_file.close()  # Interrupted after the checkpoint at two files, with the third written but not marked
+    writer = HighlightCsvWriter(csv_path, "library", file_paths, flush_every=2)
+    assert writer.done == 2
+    for path in file_paths[writer.done:]:
+        writer.write_file_rows(path, rows[path])
+    writer.close()
+    assert read_rows(csv_path) == [dict({field: "" for field in HIGHLIGHT_FIELDS}, **row) for path in file_paths for row in rows[path]]
+    # A marker from another library is ignored and the CSV started over
+    writer = HighlightCsvWriter(csv_path, "other library", file_paths, flush_every=2)
+    assert writer.done == 0
+    writer.close()
+    assert read_rows(csv_path) == []
+
+def test_extract_library_matches_across_workers(corpus, tmp_path):
+    outputs = []
+    for workers in (1, 2):
+        output_dir = tmp_path / f"workers{workers}"
+        output_dir.mkdir()
+        records = extract_library(corpus, str(output_dir / "Extracted Highlights.csv"), workers)
+        assert all(record["Status"] not in ("failed", "not run") for record in records)
+        outputs.append(read_rows(str(output_dir / "Extracted Highlights.csv")))
+    assert outputs[0] == outputs[1]
+    assert outputs[0] and all(row["Text"] and row["HighlightColor"] in ("Yellow", "Blue") for row in outputs[0])
+    assert {row["Model"] for row in outputs[0]} == {"Civic", "Camry"}
+
+def test_iter_parallel_blames_only_the_crashing_job():
+    results = {index: (result, error) for index, result, error in iter_parallel(crash_on, [(value, 17) for value in range(40)], 2)}
+    assert sorted(results) == list(range(40))
+    assert results.pop(17) == (None, "Worker process crashed")
+    assert results == {value: (value * 2, None) for value in results}
+
+def test_split_parts_stay_under_the_ceiling(tmp_path, monkeypatch):
+    import fitz
+    input_path = str(tmp_path / "manual.pdf")
+    split_test_document(input_path)
+    with fitz.open(input_path) as doc:
+        page_xrefs, xref_sizes = si_core.estimate_page_sizes(doc)
+        page_kb = [sum(xref_sizes[xref] for xref in xrefs) / 1024 for xrefs in page_xrefs]
+    max_part_kb = 2.5 * max(page_kb)  # Two pages to a part, give or take
+    part_paths = si_core.split_pdf_by_size(input_path, str(tmp_path / "parts"), max_part_kb)
+    assert 1 < len(part_paths) < len(page_kb)
+    assert all(os.path.getsize(path) / 1024 <= max_part_kb for path in part_paths)
+    # An estimate that misses everything still ends up with parts under the ceiling, checked after saving
+    monkeypatch.setattr(si_core, "estimate_page_sizes", lambda doc: ([set() for page in doc], {}))
+    part_paths = si_core.split_pdf_by_size(input_path, str(tmp_path / "underestimated"), max_part_kb)
+    assert all(os.path.getsize(path) / 1024 <= max_part_kb for path in part_paths)
+    with fitz.open(input_path) as doc:
+        assert sum(len(fitz.open(path)) for path in part_paths) == len(doc)
+    assert not [name for name in os.listdir(tmp_path / "underestimated") if name.endswith(".tmp")]
+
+def test_triage_counts_highlights_without_loading_pages(tmp_path):
+    import fitz
+    path = str(tmp_path / "manual.pdf")
+    make_document(path, random.Random(4), 12, 0, 0.5, 0.5)
+    with fitz.open(path) as doc:
+        highlights = sum(1 for page in doc for annot in page.annots() if annot.type[1] == "Highlight")
+        doc.save(str(tmp_path / "packed.pdf"), use_objstms=True, garbage=1)  # Annotations inside compressed object streams
+    assert highlights
+    assert si_core.triage_file(path) == {"annotations": highlights, "pages": 12}
+    assert si_core.triage_file(str(tmp_path / "packed.pdf")) == {"annotations": highlights, "pages": 12}
+    make_document(str(tmp_path / "plain.pdf"), random.Random(4), 3, 0, 0.0, 0.0)
+    assert si_core.triage_file(str(tmp_path / "plain.pdf")) == {"annotations": 0, "pages": 3}
+    (tmp_path / "broken.pdf").write_bytes(b"not a pdf")
+    assert si_core.triage_file(str(tmp_path / "broken.pdf"))["annotations"]  # Left for the full scan to report
+
+def test_cached_files_are_not_reindexed(corpus, tmp_path, monkeypatch):
+    from si_search import HighlightIndex, INDEX_FILE_NAME
+    csv_path = str(tmp_path / "Extracted Highlights.csv")
+    extract_library(corpus, csv_path)
+    with HighlightIndex.for_output(str(tmp_path)) as index:
+        indexed = index.library_rows(corpus)
+    replaced = []
+    replace_file = HighlightIndex.replace_file
+    monkeypatch.setattr(HighlightIndex, "replace_file", lambda self, file_path, rows: replaced.append(file_path) or replace_file(self, file_path, rows))
+    assert all(record["Status"] == "cached" for record in extract_library(corpus, csv_path))
+    assert replaced == []
+    os.remove(tmp_path / INDEX_FILE_NAME)  # A lost index is rebuilt from the cache
+    extract_library(corpus, csv_path)
+    with HighlightIndex.for_output(str(tmp_path)) as index:
+        assert replaced and index.library_rows(corpus) == indexed
+
+def test_files_without_highlights_are_cached_without_hashing(tmp_path, monkeypatch):
+    import fitz
+    import si_cache
+    model_path = tmp_path / "library" / "Honda" / "2019" / "Civic"
+    model_path.mkdir(parents=True)
+    file_path = str(model_path / "2019 Honda Civic (ACC).pdf")
+    doc = fitz.open()
+    doc.new_page().insert_text((72, 72), "no highlights here")
+    doc.save(file_path)
+    doc.close()
+    hashed = []
+    file_hash = si_cache.file_hash
+    monkeypatch.setattr(si_cache, "file_hash", lambda path: hashed.append(path) or file_hash(path))
+    csv_path = str(tmp_path / "Extracted Highlights.csv")
+    assert [record["Status"] for record in extract_library(str(tmp_path / "library"), csv_path)] == ["no highlights"]
+    assert [record["Status"] for record in extract_library(str(tmp_path / "library"), csv_path)] == ["cached"]
+    os.utime(file_path, (time.time() + 10, time.time() + 10))  # Touched: without a stored hash it is triaged again
+    assert [record["Status"] for record in extract_library(str(tmp_path / "library"), csv_path)] == ["no highlights"]
+    assert hashed == []
+
+def test_a_file_that_failed_to_open_is_not_cached(tmp_path, monkeypatch):
+    model_path = tmp_path / "library" / "Honda" / "2019" / "Civic"
+    model_path.mkdir(parents=True)
+    make_document(str(model_path / "2019 Honda Civic (ACC).pdf"), random.Random(6), 4, 0, 1.0, 0.0)
+    csv_path = str(tmp_path / "Extracted Highlights.csv")
+    open_pdf = si_core.open_pdf
+
+    def share_unavailable(file_path):
+        raise RuntimeError("network path not found")
+
+    monkeypatch.setattr(si_core, "open_pdf", share_unavailable)
+    assert [record["Status"] for record in extract_library(str(tmp_path / "library"), csv_path)] == ["failed"]
+    assert [row["Text"] for row in read_rows(csv_path)] == ["Could not open file."]
+    errors = []
+    assert [record["Status"] for record in si_core.copy_library(str(tmp_path / "library"), str(tmp_path), on_error=lambda *error: errors.append(error))] == ["failed"]
+    assert errors == [(str(model_path / "2019 Honda Civic (ACC).pdf"), "Could not open file.")]
+    monkeypatch.setattr(si_core, "open_pdf", open_pdf)
+    assert [record["Status"] for record in extract_library(str(tmp_path / "library"), csv_path)] == ["extracted"]
+    assert len(read_rows(csv_path)) == 4 and all(row["HighlightColor"] == "Yellow" for row in read_rows(csv_path))
+
+def test_cache_hashes_come_from_the_worker(corpus, tmp_path, monkeypatch):
+    hashed = []
+    file_hash = si_cache.file_hash
+    monkeypatch.setattr(si_cache, "file_hash", lambda path: hashed.append(path) or file_hash(path))
+    csv_path = str(tmp_path / "Extracted Highlights.csv")
+    assert all(record["Status"] == "extracted" for record in extract_library(corpus, csv_path))
+    assert all(record["Status"] == "copied" for record in si_core.copy_library(corpus, str(tmp_path)))
+    assert hashed == []
+    with si_cache.ScanCache.for_output(str(tmp_path)) as cache:
+        rows = cache.conn.execute("SELECT path, hash FROM files").fetchall()
+    assert rows and all(content_hash == file_hash(path) for path, content_hash in rows)
+    # Touched but unchanged: recognised by the stored hash
+    path = rows[0][0]
+    stat = os.stat(path)
+    os.utime(path, (time.time() + 10, time.time() + 10))
+    try:
+        assert {record["Status"] for record in extract_library(corpus, csv_path)} == {"cached"}
+    finally:
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))  # The corpus is shared with other tests
+
+def test_readme_search_example(corpus, tmp_path, capsys):
+    extract_library(corpus, str(tmp_path / "Extracted Highlights.csv"))
+    capsys.readouterr()
+    assert si_cli.main(["search", str(tmp_path), "calibrat*", "--year", "2019", "--make", "Honda", "--color", "yellow", "--json"]) == 0
+    matches = json.loads(capsys.readouterr().out)
+    assert matches and all("calibrate" in match["Text"] and match["HighlightColor"] == "Yellow" for match in matches)
+
+def noise_document(path, pages, size):
+    # Pages whose image doesn't compress, so the file stays oversized after compress_pdf
+    import fitz
+    doc = fitz.open()
+    for page_num in range(pages):
+        image = fitz.Pixmap(fitz.csRGB, size, size, random.Random(page_num).randbytes(size * size * 3), False)
+        doc.new_page().insert_image(fitz.Rect(72, 72, 540, 540), pixmap=image)
+    doc.save(path, deflate=True)
+    doc.close()
+
+def test_compress_twice_leaves_the_library_settled(tmp_path):
+    model_path = tmp_path / "library" / "Honda" / "2019" / "Civic"
+    model_path.mkdir(parents=True)
+    noise_document(str(model_path / "2019 Honda Civic (ACC).pdf"), 1, 900)  # One page over the part ceiling
+    noise_document(str(model_path / "2019 Honda Civic (LKA).pdf"), 3, 450)
+    trees = []
+    for run in range(2):
+        records = si_core.compress_library(str(tmp_path / "library"), str(tmp_path))
+        assert all(record["Status"] != "failed" for record in records)
+        trees.append(sorted(os.path.relpath(os.path.join(dir_path, name), model_path) for dir_path, _, names in os.walk(model_path) for name in names))
+        with open(tmp_path / "oversized_files_report.csv", newline="", encoding="utf-8") as csv_file:
+            rows = list(csv.DictReader(csv_file))
+        if run == 0:
+            assert {(row["Year"], row["Make"], row["Model"], row["Parts"]) for row in rows} == {("2019", "Honda", "Civic", "1"), ("2019", "Honda", "Civic", "2")}
+    assert trees[0] == trees[1] == ["2019 Honda Civic (ACC).pdf", os.path.join("2019 Honda Civic (LKA)", "2019 Honda Civic (LKA) part-1.pdf"),
+                                    os.path.join("2019 Honda Civic (LKA)", "2019 Honda Civic (LKA) part-2.pdf")]
+
+def test_oversized_report_for_a_pdf_above_the_model_level(tmp_path):
+    (tmp_path / "library").mkdir()
+    noise_document(str(tmp_path / "library" / "big.pdf"), 1, 900)
+    records = si_core.compress_library(str(tmp_path / "library"), str(tmp_path))
+    assert [record["Status"] for record in records] == ["oversized"]
+    with open(tmp_path / "oversized_files_report.csv", newline="", encoding="utf-8") as csv_file:
+        assert [(row["Year"], row["Make"], row["Model"]) for row in csv.DictReader(csv_file)] == [("N/A", "N/A", "N/A")]
+    entry = si_core.manifest_entry(str(tmp_path), os.path.join(str(tmp_path), "Honda", "2019", "Civic", "x", "2019 Honda Civic (ACC) part-1.pdf"))
+    assert (entry.make, entry.year, entry.model, entry.system) == ("Honda", "2019", "Civic", "ACC")
+
+def test_compress_copies_a_shared_image_once(tmp_path):
+    import fitz
+    path = str(tmp_path / "shared.pdf")
+    doc = fitz.open()
+    image = fitz.Pixmap(synthetic_image(random.Random(1), 1200), 0)
+    xref = 0
+    for page_num in range(20):
+        page = doc.new_page()
+        xref = page.insert_image(fitz.Rect(72, 72, 360, 360), pixmap=image) if not xref else page.insert_image(fitz.Rect(72, 72, 360, 360), xref=xref)
+    doc.save(path, deflate=True)
+    doc.close()
+    result = si_core.compress_pdf(path, preset="email")
+    assert not result["error"] and result["images"] == 1
+    with fitz.open(path) as doc:
+        assert len(doc) == 20 and len({image[0] for page in doc for image in page.get_images()}) == 1
+
+def test_ledger_takeover_race(tmp_path, monkeypatch):
+    # Node B takes over an expired lease between node A reading it and renaming it aside
+    ledger_a, ledger_b = si_shard.Ledger(str(tmp_path), 60, "a"), si_shard.Ledger(str(tmp_path), 60, "b")
+    si_shard.write_json_atomic(ledger_a.lease_path("shard"), {"node": "c", "token": "old", "expires": time.time() - 1})
+    read_lease_file = si_shard.read_lease_file
+    leases_b = []
+
+    def read_then_b_claims(path):
+        seen = read_lease_file(path)
+        monkeypatch.setattr(si_shard, "read_lease_file", read_lease_file)
+        leases_b.append(ledger_b.claim("shard"))
+        return seen
+
+    monkeypatch.setattr(si_shard, "read_lease_file", read_then_b_claims)
+    assert ledger_a.claim("shard") is None
+    assert leases_b[0] is not None and leases_b[0].held()
+    assert ledger_a.claim("shard") is None  # Still B's, and live
+    assert os.listdir(tmp_path / "leases") == ["shard.json"]
+
+def test_lease_is_given_up_instead_of_renewed_near_expiry(tmp_path):
+    ledger = si_shard.Ledger(str(tmp_path), 60, "a")
+    lease = ledger.claim("shard")
+    lease.renew()
+    assert not lease.lost
+    si_shard.write_json_atomic(lease.path, dict(ledger.lease_record(lease.token), expires=time.time() + 5))  # Stalled for most of its lifetime
+    lease.renew()
+    assert lease.lost
+
+def test_crawl_survives_symlink_loops_and_vanishing_files(tmp_path, monkeypatch):
+    model_path = tmp_path / "Honda" / "2019" / "Civic"
+    model_path.mkdir(parents=True)
+    (model_path / "2019 Honda Civic (ACC).pdf").write_bytes(b"%PDF-1.7")
+    (model_path / "2019 Honda Civic (LKA).pdf").write_bytes(b"%PDF-1.7")
+    os.symlink(tmp_path, model_path / "loop", target_is_directory=True)
+    scandir = os.scandir
+
+    def scandir_then_delete(path):
+        entries = list(scandir(path))
+        if path == str(model_path):
+            os.remove(model_path / "2019 Honda Civic (LKA).pdf")  # Gone between the listing and stat()
+        return entries
+
+    monkeypatch.setattr(os, "scandir", scandir_then_delete)
+    manifest = si_core.crawl_library(str(tmp_path))
+    assert [(entry.make, entry.year, entry.model, entry.system) for entry in manifest] == [("Honda", "2019", "Civic", "ACC")]
+
+def add_yellow_highlight(path, page_num):
+    # Edits a PDF in place the way a reviewer would, which moves its size and mtime
+    import fitz
+    with fitz.open(path) as doc:
+        page = doc[page_num]
+        annot = page.add_highlight_annot(fitz.Rect(70, 80, 360, 94))
+        annot.set_colors(stroke=(1, 1, 0))
+        annot.update()
+        doc.save(path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+def test_copy_rescans_a_pdf_edited_since_the_last_copy(tmp_path):
+    import fitz
+    model_path = tmp_path / "library" / "Honda" / "2019" / "Civic"
+    model_path.mkdir(parents=True)
+    file_path = str(model_path / "2019 Honda Civic (ACC).pdf")
+    make_document(file_path, random.Random(5), 6, 0, 0.0, 0.0)
+    add_yellow_highlight(file_path, 1)
+    output_path = tmp_path / "copies"
+    output_path.mkdir()
+    highlight_index = {}
+    assert [record["Status"] for record in si_core.copy_library(str(tmp_path / "library"), str(output_path), ("Yellow",), highlight_index=highlight_index)] == ["copied"]
+    add_yellow_highlight(file_path, 4)
+    assert [record["Status"] for record in si_core.copy_library(str(tmp_path / "library"), str(output_path), ("Yellow",), highlight_index=highlight_index)] == ["copied"]
+    with fitz.open(str(output_path / "2019 Honda Civic (ACC)_Yellow.pdf")) as copy:
+        assert len(copy) == 2
+    # Colors handed in through the index are used but never written to the on-disk cache
+    os.remove(output_path / "2019 Honda Civic (ACC)_Yellow.pdf")
+    stat = os.stat(file_path)
+    highlight_index = {file_path: (stat.st_size, stat.st_mtime, {0: {"Yellow"}})}
+    assert [record["Status"] for record in si_core.copy_library(str(tmp_path / "library"), str(output_path), ("Yellow",), highlight_index=highlight_index)] == ["copied"]
+    # A new session (no shared index) finds the colors of the edited file in the on-disk cache
+    assert [record["Status"] for record in si_core.copy_library(str(tmp_path / "library"), str(output_path), ("Yellow",))] == ["cached"]
+    with si_cache.ScanCache.for_output(str(output_path), si_core.default_classifier.signature()) as cache:
+        assert sorted(cache.lookup(file_path)["page_colors"]) == [1, 4]
+
+def test_watch_retries_a_file_that_failed(tmp_path, monkeypatch):
+    model_path = tmp_path / "library" / "Honda" / "2019" / "Civic"
+    model_path.mkdir(parents=True)
+    file_path = str(model_path / "2019 Honda Civic (ACC).pdf")
+    make_document(file_path, random.Random(7), 3, 0, 1.0, 0.0)
+    output_dir = tmp_path / "reports"
+    output_dir.mkdir()
+    si_watch.save_state(str(output_dir / si_watch.STATE_FILE_NAME), str(tmp_path / "library"), {})  # Arrived after watching started
+    monkeypatch.setattr(si_watch, "RETRY_SECONDS", 0)
+    monkeypatch.setattr(si_watch, "TICK_SECONDS", 0.01)
+    extract_file_highlights = si_watch.extract_file_highlights
+    attempts = []
+    monkeypatch.setattr(si_watch, "extract_file_highlights", lambda *args: None if not attempts.append(args) and len(attempts) == 1 else extract_file_highlights(*args))
+    records = si_watch.watch_library(str(tmp_path / "library"), str(output_dir), compress=False, debounce_seconds=0, poll_seconds=0, use_events=False,
+                                     cancelled=lambda: len(attempts) >= 2)
+    assert [record["Status"] for record in records] == ["failed", "processed"]
+    assert si_watch.load_state(str(output_dir / si_watch.STATE_FILE_NAME), str(tmp_path / "library")) == {file_path: si_watch.file_signature(file_path)}
+
+def test_distributed_extract_writes_the_same_csv_for_unopenable_files(corpus, tmp_path, monkeypatch):
+    from si_search import HighlightIndex
+    broken = sorted(entry.path for entry in si_core.library_entries(si_core.crawl_library(corpus)))[0]
+    open_pdf = si_core.open_pdf
+    monkeypatch.setattr(si_core, "open_pdf", lambda file_path, *args: open_pdf(file_path, *args) if file_path != broken else 1 / 0)
+    (tmp_path / "local").mkdir()
+    (tmp_path / "shared").mkdir()
+    extract_library(corpus, str(tmp_path / "local" / "Extracted Highlights.csv"))
+    si_shard.run_distributed("extract-highlights", corpus, str(tmp_path / "shared"), str(tmp_path / "ledger"))
+    rows = read_rows(str(tmp_path / "shared" / "Extracted Highlights.csv"))
+    assert rows == read_rows(str(tmp_path / "local" / "Extracted Highlights.csv"))
+    assert [row["Text"] for row in rows].count("Could not open file.") == 1
+    with HighlightIndex.for_output(str(tmp_path / "shared")) as index:
+        assert not index.has_file(broken)